@@ -0,0 +1,276 @@
+"""lunchbot 핫 패스 마이크로벤치마크 (네트워크 없이 fixtures/ 의 파일만 사용)
+
+    python bench.py                                  # 실행 후 결과 출력
+    python bench.py --save bench_baseline.json       # 결과를 기준선으로 저장
+    python bench.py --compare bench_baseline.json    # 기준선과 비교, 느려진 항목이 있으면 종료 코드 1
+    python bench.py --record                         # 실제 API 응답으로 fixture 갱신 (네트워크 필요)
+"""
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import platform
+import tempfile
+import logging
+import statistics
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import main
+
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+PHOTO_DIR = os.path.join(BENCH_DIR, "fixtures", "photos")
+KMA_FIXTURE = os.path.join(FIXTURE_DIR, "kma_ultra_srt_fcst.json")
+NEIS_FIXTURE = os.path.join(FIXTURE_DIR, "neis_meal.json")
+HOMEPAGE_FIXTURE = os.path.join(FIXTURE_DIR, "homepage.html")
+FIXTURE_NOW = datetime(2025, 5, 19, 6, 50)  # fixture가 기록된 시각
+DEFAULT_THRESHOLD = 0.2  # 기준선보다 20% 이상 느리면 회귀로 표시
+
+BENCHMARKS = []
+
+def bench(name):
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+# =========================
+# fixture 로드
+# =========================
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def load_fixtures():
+    with open(HOMEPAGE_FIXTURE, encoding="utf-8") as f:
+        homepage = f.read()
+    photos = sorted(glob.glob(os.path.join(PHOTO_DIR, "*.jpg")))
+    return {
+        "kma": load_json(KMA_FIXTURE),
+        "neis": load_json(NEIS_FIXTURE),
+        "homepage": homepage,
+        "photos": photos,
+        "photo": next((p for p in photos if p.endswith("_lunch_photo.jpg")), photos[0]),
+    }
+
+def offline(*args, **kwargs):
+    raise RuntimeError("benchmark must run offline")
+
+# =========================
+# 벤치마크 항목 (설정 후 측정할 함수를 돌려줌)
+# =========================
+def fixture_forecast_store(fx):
+    """fixture 발표분을 넣은 메모리 예보 저장소"""
+    # fixture 발표분이 보관 기간에 걸려 지워지지 않도록 기간을 넉넉히
+    store = main.ForecastStore(":memory:", keep_days=100000)
+    store.store("60", "127", "202505190630", fx["kma"])
+    return store
+
+@bench("weather.forecast_store_summary")
+def bench_forecast_store_summary(fx):
+    store = fixture_forecast_store(fx)
+    return lambda: store.summary("60", "127", FIXTURE_NOW)
+
+@bench("weather.group_time_ranges")
+def bench_group_time_ranges(fx):
+    times = ["06:00", "07:00", "08:00", "10:00", "13:00", "14:00", "15:00", "16:00", "20:00", "21:00", "23:00"]
+    return lambda: main.group_time_ranges(times)
+
+@bench("meal.clean_menu_text")
+def bench_clean_menu_text(fx):
+    dishes = [row["DDISH_NM"] for row in fx["neis"]["mealServiceDietInfo"][1]["row"]]
+    def run():
+        for ddish_nm in dishes:
+            main.clean_menu_text(ddish_nm)
+    return run
+
+@bench("scrape.parse_lunch_image_url")
+def bench_parse_lunch_image_url(fx):
+    return lambda: main.parse_lunch_image_url(fx["homepage"], main.SCHOOL_HOMEPAGE_URL)
+
+@bench("photo.load_meal_photo")
+def bench_load_meal_photo(fx):
+    def run():
+        for path in fx["photos"]:
+            main._photo_thumbnails.clear()
+            main.load_meal_photo(path)
+    return run
+
+def fixture_menu(fx, index=1):
+    return main.clean_menu_text(fx["neis"]["mealServiceDietInfo"][1]["row"][index]["DDISH_NM"])
+
+# 스토리는 실제 작업과 같은 build_story(지문 -> 렌더링 -> 인코딩) 경로로 측정 (렌더링 캐시는 끔)
+@bench("story.menu")
+def bench_story_menu(fx):
+    menu = fixture_menu(fx)
+    return lambda: main.build_story(main.render_menu_image, (menu, "중식"))
+
+@bench("story.weather")
+def bench_story_weather(fx):
+    weather = fixture_forecast_store(fx).summary("60", "127", FIXTURE_NOW)
+    return lambda: main.build_story(main.render_weather_image, (weather,))
+
+@bench("story.daily")
+def bench_story_daily(fx):
+    # 07:00 작업의 중식/석식/날씨 한 번에 렌더링 (RENDER_WORKERS 설정을 따름)
+    lunch, dinner = fixture_menu(fx, 1), fixture_menu(fx, 2)
+    weather = fixture_forecast_store(fx).summary("60", "127", FIXTURE_NOW)
+    return lambda: main.render_daily_stories(lunch, dinner, weather)
+
+@bench("story.menu_with_photo")
+def bench_story_menu_with_photo(fx):
+    menu = fixture_menu(fx)
+    def run():
+        # 급식 사진은 하루 한 번 디코딩되므로 축소본 캐시 없이 측정
+        main._photo_thumbnails.clear()
+        main.build_story(main.render_menu_story_image_with_photo, (menu, "중식", fx["photo"]))
+    return run
+
+@bench("story.photo_only")
+def bench_story_photo_only(fx):
+    menu = fixture_menu(fx)
+    def run():
+        main._photo_thumbnails.clear()
+        main.build_story(main.render_menu_photo_story_image, (fx["photo"], menu))
+    return run
+
+class UncachedFingerprintStore(main.FingerprintStore):
+    """렌더링 캐시를 쓰지 않는 저장소 (build_story가 매번 실제로 렌더링/인코딩하도록)"""
+    def load_rendered(self, fingerprint):
+        return None
+
+    def store_rendered(self, fingerprint, data):
+        pass
+
+# =========================
+# 측정/비교
+# =========================
+def measure(func, repeat=5, min_time=0.2):
+    """호출 한 번당 시간(초)을 repeat번 측정 (각 측정은 min_time 이상 반복)"""
+    func()  # 폰트/레이어 캐시 등 워밍업
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {"loops": number, "min": min(samples), "median": statistics.median(samples)}
+
+def run_benchmarks(selected=None, repeat=5):
+    fixtures = load_fixtures()
+    results = {}
+    for name, setup in BENCHMARKS:
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = measure(setup(fixtures), repeat=repeat)
+        print(f"{name:45s} {format_seconds(results[name]['median']):>12s}  (min {format_seconds(results[name]['min'])})")
+    return results
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+def compare(results, baseline, threshold):
+    """기준선 대비 중앙값 비율을 출력하고 회귀 항목 목록 반환"""
+    regressions = []
+    print(f"\n{'benchmark':45s} {'baseline':>12s} {'current':>12s} {'ratio':>7s}")
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:45s} {'-':>12s} {format_seconds(result['median']):>12s}    new")
+            continue
+        ratio = result["median"] / base["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{name:45s} {format_seconds(base['median']):>12s} {format_seconds(result['median']):>12s} {ratio:6.2f}x{flag}")
+    return regressions
+
+# =========================
+# fixture 기록 (네트워크 필요)
+# =========================
+def record_fixtures():
+    """실제 기상청/나이스/학교 홈페이지 응답으로 fixture를 덮어씀"""
+    now = datetime.now()
+    base_date, _ = main.get_forecast_base(now)
+    resp = main.http_transport.get(main.forecast_url(base_date, "0630", main.NX, main.NY))
+    resp.raise_for_status()
+    write_json(KMA_FIXTURE, resp.json())
+    from_ymd, to_ymd = main.month_range(now.strftime("%Y%m"))
+    resp = main.http_transport.get(main.neis_meal_url(from_ymd, to_ymd, 1))
+    resp.raise_for_status()
+    write_json(NEIS_FIXTURE, resp.json())
+    resp = main.http_transport.get(main.SCHOOL_HOMEPAGE_URL)
+    resp.raise_for_status()
+    with open(HOMEPAGE_FIXTURE, "w", encoding="utf-8") as f:
+        f.write(resp.text)
+    print(f"Fixtures recorded at {now:%Y-%m-%d %H:%M} (update FIXTURE_NOW to match)")
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="lunchbot 마이크로벤치마크")
+    parser.add_argument("--save", metavar="PATH", help="결과를 JSON 기준선으로 저장")
+    parser.add_argument("--compare", metavar="PATH", help="JSON 기준선과 비교")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="회귀로 볼 중앙값 증가 비율")
+    parser.add_argument("--repeat", type=int, default=5, help="항목별 측정 횟수")
+    parser.add_argument("--only", nargs="*", help="이름에 이 문자열이 들어간 항목만 실행")
+    parser.add_argument("--record", action="store_true", help="실제 API 응답으로 fixture 갱신")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+        return 0
+
+    # 측정 중 실수로 네트워크를 타지 않도록 막고, 렌더링 결과는 임시 디렉터리에만 씀 (span 기록도 남기지 않음)
+    main.http_transport.request = offline
+    main.http_transport.stream = offline
+    workdir = tempfile.TemporaryDirectory(prefix="lunchbot-bench-")
+    main.IG_IMAGE_PATH = workdir.name
+    main.METRICS_PATH = ""
+    main.fingerprint_store = UncachedFingerprintStore(os.path.join(workdir.name, "fingerprints.db"), workdir.name)
+    main.logger.setLevel(logging.WARNING)
+    try:
+        results = run_benchmarks(args.only, args.repeat)
+    finally:
+        workdir.cleanup()
+
+    if args.save:
+        baseline = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        write_json(args.save, baseline)
+        print(f"\nBaseline saved: {args.save}")
+    if args.compare:
+        regressions = compare(results, load_json(args.compare), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
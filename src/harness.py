@@ -0,0 +1,499 @@
+"""가짜 업스트림(나이스/기상청/학교 홈페이지/인스타그램)을 띄워 실제 작업 함수를 돌리는 부하/장애 테스트
+
+    python harness.py --tenants 50 --concurrency 8
+    python harness.py --scenario flaky --tenants 20
+    python harness.py --latency neis=0.5 --error-rate kma=0.3 --tls-fail homepage --max-job-seconds 30
+
+가짜 서버는 127.0.0.1에서 하나의 포트로 뜨고, HttpTransport.overrides로
+실제 호스트 요청을 경로 접두사(/neis, /kma, /homepage, /ig)로 돌려보낸다.
+작업은 임시 디렉터리에서 실행되므로 캐시/보관소 파일이 남지 않는다.
+"""
+import os
+import sys
+import json
+import logging
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HARNESS_DIR)
+
+import main
+
+FIXTURE_DIR = os.path.join(HARNESS_DIR, "fixtures")
+PHOTO_PATH = os.path.join(HARNESS_DIR, "fixtures", "photos", "20250519_lunch_photo.jpg")
+FIXTURE_DATE = datetime(2025, 5, 19)
+IG_HOST = "i.instagram.com"
+UPSTREAM_NAMES = ("neis", "kma", "homepage", "ig")
+
+# 미리 정의한 장애 시나리오 (업스트림 이름 -> 설정)
+SCENARIOS = {
+    "baseline": {},
+    "slow": {name: {"latency": 0.5} for name in UPSTREAM_NAMES},
+    "flaky": {name: {"error_rate": 0.3} for name in ("neis", "kma", "homepage")},
+    "tls": {"homepage": {"tls_fail": True}, "kma": {"tls_fail": True}},
+    "oversized": {"homepage": {"oversized": 8 * 1024 * 1024}, "kma": {"oversized": 4 * 1024 * 1024}},
+    # 타임아웃보다 오래 응답하지 않는 업스트림: 작업이 매달리지 않고 끝나는지 확인
+    "blackhole": {"kma": {"latency": 60}, "homepage": {"latency": 60}},
+}
+
+class Fault:
+    """업스트림 하나의 지연/오류율/TLS 실패/과대 응답 설정"""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, tls_fail=False, oversized=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tls_fail = tls_fail
+        self.oversized = oversized
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self):
+        return self.error_rate and random.random() < self.error_rate
+
+# =========================
+# 가짜 업스트림 서버
+# =========================
+class FakeUpstreams:
+    """fixture를 오늘 날짜에 맞춰 돌려주는 가짜 서버와 요청 통계"""
+    def __init__(self, faults):
+        self.faults = faults
+        self.lock = threading.Lock()
+        self.requests = {name: 0 for name in UPSTREAM_NAMES}
+        self.errors = {name: 0 for name in UPSTREAM_NAMES}
+        self.uploads = 0
+        self.upload_bytes = 0
+        with open(os.path.join(FIXTURE_DIR, "kma_ultra_srt_fcst.json"), encoding="utf-8") as f:
+            self.kma = json.load(f)
+        with open(os.path.join(FIXTURE_DIR, "neis_meal.json"), encoding="utf-8") as f:
+            self.neis_rows = json.load(f)["mealServiceDietInfo"][1]["row"]
+        with open(os.path.join(FIXTURE_DIR, "homepage.html"), encoding="utf-8") as f:
+            self.homepage = f.read()
+        with open(PHOTO_PATH, "rb") as f:
+            self.photo = f.read()
+        handler = type("Handler", (FakeHandler,), {"upstreams": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-upstreams", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def base_url(self, name):
+        # TLS 실패: 평문 HTTP 서버에 https로 접속시켜 핸드셰이크를 실패시킴
+        scheme = "https" if self.faults[name].tls_fail else "http"
+        return f"{scheme}://127.0.0.1:{self.port}/{name}"
+
+    def count(self, name, error=False):
+        with self.lock:
+            self.requests[name] += 1
+            if error:
+                self.errors[name] += 1
+
+    def neis_body(self, query):
+        from_ymd = query["MLSV_FROM_YMD"][0]
+        to_ymd = query["MLSV_TO_YMD"][0]
+        page = int(query.get("pIndex", ["1"])[0])
+        size = int(query.get("pSize", ["100"])[0])
+        rows = []
+        day = datetime.strptime(from_ymd, "%Y%m%d")
+        end = datetime.strptime(to_ymd, "%Y%m%d")
+        while day <= end:
+            for code in ("1", "2", "3"):
+                source = self.neis_rows[len(rows) % len(self.neis_rows)]
+                rows.append({**source, "MMEAL_SC_CODE": code, "MLSV_YMD": day.strftime("%Y%m%d")})
+            day += timedelta(days=1)
+        page_rows = rows[(page - 1) * size:page * size]
+        head = [{"list_total_count": len(rows)}, {"RESULT": {"CODE": "INFO-000", "MESSAGE": "정상 처리되었습니다."}}]
+        return {"mealServiceDietInfo": [{"head": head}, {"row": page_rows}]}
+
+    def kma_body(self, query):
+        offset = datetime.strptime(query["base_date"][0], "%Y%m%d") - FIXTURE_DATE
+        items = []
+        for item in self.kma["response"]["body"]["items"]["item"]:
+            fcst_date = datetime.strptime(item["fcstDate"], "%Y%m%d") + offset
+            items.append({**item, "baseDate": query["base_date"][0], "fcstDate": fcst_date.strftime("%Y%m%d")})
+        body = json.loads(json.dumps(self.kma))
+        body["response"]["body"]["items"]["item"] = items
+        return body
+
+class FakeHandler(BaseHTTPRequestHandler):
+    upstreams = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def dispatch(self):
+        parts = urlsplit(self.path)
+        name, _, rest = parts.path.lstrip("/").partition("/")
+        if name not in UPSTREAM_NAMES:
+            self.send_error(404)
+            return
+        fault = self.upstreams.faults[name]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        fault.delay()
+        if fault.should_fail():
+            self.upstreams.count(name, error=True)
+            self.respond(503, b"upstream error", "text/plain")
+            return
+        self.upstreams.count(name)
+        query = parse_qs(parts.query)
+        if name == "neis":
+            self.respond_json(self.upstreams.neis_body(query), fault.oversized)
+        elif name == "kma":
+            self.respond_json(self.upstreams.kma_body(query), fault.oversized)
+        elif name == "homepage" and rest.startswith("upload/"):
+            self.respond_photo(fault.oversized)
+        elif name == "homepage":
+            html = self.upstreams.homepage
+            if fault.oversized:
+                # 급식 섹션 앞에 큰 주석을 끼워 넣어 파서가 끝까지 읽게 함
+                html = html.replace("<body>", "<body><!--" + "x" * fault.oversized + "-->", 1)
+            self.respond(200, html.encode("utf-8"), "text/html; charset=utf-8")
+        else:
+            with self.upstreams.lock:
+                self.upstreams.uploads += 1
+                self.upstreams.upload_bytes += len(body)
+            self.respond_json({"status": "ok", "media": {"pk": str(random.getrandbits(48))}})
+
+    def respond(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def respond_json(self, data, oversized=0):
+        if oversized:
+            data = {**data, "padding": "x" * oversized}
+        self.respond(200, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def respond_photo(self, oversized=0):
+        if oversized:
+            # 실제 본문 대신 크기만 큰 응답: 클라이언트가 헤더만 보고 거절해야 함
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(main.PHOTO_MAX_BYTES + oversized))
+            self.end_headers()
+            try:
+                self.wfile.write(self.upstreams.photo)
+            except OSError:
+                pass
+            self.close_connection = True
+            return
+        self.respond(200, self.upstreams.photo, "image/jpeg", {"ETag": '"harness-photo"'})
+
+# =========================
+# 가짜 인스타그램 봇
+# =========================
+class HarnessBot:
+    """스토리를 가짜 업로드 엔드포인트로 보내는 봇 (전송 계층의 지연/오류 설정을 그대로 받음)"""
+    def __init__(self, username):
+        self.username = username
+
+    def upload_story(self, story):
+        with main.span("upload", account=self.username, bytes=len(story)):
+            resp = main.http_transport.request("POST", f"https://{IG_HOST}/api/v1/media/configure_to_story/",
+                                               content=bytes(story))
+            resp.raise_for_status()
+        main.metrics.inc("lunchbot_uploads_total", account=self.username)
+
+def harness_bot(tenant=None):
+    tenant = tenant or main.DEFAULT_TENANT
+    return HarnessBot(tenant.ig_username)
+
+# =========================
+# 실행/집계
+# =========================
+def build_tenants(count, shared):
+    """가짜 학교 목록 (shared면 같은 학교/격자/홈페이지를 공유해 캐시 효과를 측정)"""
+    tenants = []
+    for i in range(count):
+        key = 0 if shared else i
+        tenants.append(main.Tenant(
+            f"t{i}", "B10", f"{9000000 + key}", str(60 + key % 50), str(127 + key % 50),
+            f"acct{i}", "password", homepage_url=f"https://school{key}.harness.invalid",
+        ))
+    return tenants
+
+def configure(upstreams, tenants, timeout):
+    overrides = {
+        "open.neis.go.kr": upstreams.base_url("neis"),
+        "apis.data.go.kr": upstreams.base_url("kma"),
+        IG_HOST: upstreams.base_url("ig"),
+    }
+    homepage_config = dict(main.UPSTREAMS["yangchung.sen.hs.kr"], rate=1000, burst=1000)
+    main.UPSTREAMS[IG_HOST] = {"timeout": 30, "retries": 0, "verify": True, "rate": 1000, "burst": 1000}
+    for tenant in tenants:
+        host = urlsplit(tenant.homepage_url).hostname
+        overrides[host] = upstreams.base_url("homepage")
+        main.UPSTREAMS[host] = dict(homepage_config)
+    # 가짜 서버는 학교마다 따로 있는 것처럼 취급하므로 공용 호스트 속도 제한은 풀어 둠
+    for host in ("open.neis.go.kr", "apis.data.go.kr"):
+        main.UPSTREAMS[host] = dict(main.UPSTREAMS[host], rate=1000, burst=1000)
+    if timeout:
+        for config in main.UPSTREAMS.values():
+            config["timeout"] = timeout
+    main.http_transport.close()
+    main.http_transport = main.HttpTransport(overrides=overrides)
+    main.get_instagram_bot = harness_bot
+
+def reset_caches():
+    """라운드마다 새 날처럼 모든 캐시를 비움"""
+    main._meal_repositories.clear()
+    main._lunch_image_scrapers.clear()
+    main._photo_sources.clear()
+    main._photo_thumbnails.clear()
+    main.forecast_store = main.ForecastStore()
+    main.fingerprint_store = main.FingerprintStore()
+    main.photo_watch_state = main.PhotoWatchState()
+    main.outbox_uploader.stop()
+    shutil.rmtree(main.CACHE_PATH, ignore_errors=True)
+    main.upload_outbox = main.UploadOutbox()
+    main.outbox_uploader = main.OutboxUploader(main.upload_outbox)
+
+def timed(func):
+    def run(tenant):
+        start = time.perf_counter()
+        error = None
+        try:
+            func(tenant)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return time.perf_counter() - start, error
+    return run
+
+def scheduled_text_job(tenant):
+    """데몬과 같은 경로로 07:00 작업 실행 (스케줄러 준비 단계 -> 마감 시각 게시)"""
+    sched = main.DeadlineScheduler(max_workers=1)
+    try:
+        job = main.schedule_text_menu_weather(sched, tenant)
+        sched._run_warmup(job)
+        sched._publish(job, job.prepared)
+    finally:
+        sched._executor.shutdown()
+
+def photo_watch_job(tenant):
+    """데몬의 급식 사진 감시와 같은 경로로 한 번 확인해 게시
+
+    전날 사진을 게시한 기록에서 시작하므로 가짜 홈페이지의 사진은 새 사진으로 보인다.
+    마감 시각과 상관없이 돌도록 감시 루프(PhotoWatcher.run) 대신 확인 한 번(poll)만 실행한다.
+    """
+    today = datetime.now().strftime('%Y%m%d')
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+    main.photo_watch_state.record(tenant.name, yesterday, "", "")
+    watcher = main.PhotoWatcher(tenant)
+    with main.job_trace(main.job_name("lunch_photo_only_story", tenant)):
+        lunch_menu = main.get_meal_menu(2, tenant)
+        with main.span("photo_watch.poll", tenant=tenant.name):
+            if lunch_menu and not watcher.poll(lunch_menu, today):
+                raise RuntimeError("lunch photo was not posted")
+
+def simulate_restart():
+    """업로드 도중 죽고 같은 pid로 다시 뜬 데몬 흉내 (도커에서는 데몬이 늘 pid 1)
+
+    계정마다 맨 앞 대기 항목을 재시작 전 프로세스("pid:0")가 보내던 상태로 만들고 업로드 기록에도
+    그 프로세스의 자리를 남긴 뒤, 저장소 객체를 새로 만든다. 이 항목들이 올라가지 않으면 재시작 복구가 깨진 것.
+    """
+    main.outbox_uploader.stop()
+    stale = f"{os.getpid()}:0"
+    db = main.upload_outbox._db()
+    with db:
+        rows = db.execute("""
+            SELECT id, day, fingerprint, account FROM outbox o
+            WHERE state = 'pending' AND id = (SELECT MIN(h.id) FROM outbox h WHERE h.account = o.account AND h.state = 'pending')
+        """).fetchall()
+        for item_id, day, fingerprint, account in rows:
+            db.execute("UPDATE outbox SET state = 'sending', owner = ?, lease_until = ? WHERE id = ?",
+                       (stale, time.time() + main.OUTBOX_LEASE, item_id))
+    posted = main.fingerprint_store._db()
+    with posted:
+        for item_id, day, fingerprint, account in rows:
+            posted.execute("INSERT OR REPLACE INTO posted (day, fingerprint, account, owner) VALUES (?, ?, ?, ?)",
+                           (day, fingerprint, account, stale))
+    main.fingerprint_store = main.FingerprintStore()
+    main.upload_outbox = main.UploadOutbox()
+    main.outbox_uploader = main.OutboxUploader(main.upload_outbox)
+    return len(rows)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def run_harness(args, faults):
+    upstreams = FakeUpstreams(faults).start()
+    tenants = build_tenants(args.tenants, args.shared)
+    configure(upstreams, tenants, args.timeout)
+    main.RENDER_WORKERS = args.render_workers
+    if args.upload_interval is not None:
+        main.STORY_UPLOAD_INTERVAL = args.upload_interval
+    main.PIPELINE_MODE = args.pipeline
+    main.OUTBOX_RETRY_BASE = args.retry_base
+    jobs = []
+    if args.job in ("text", "both"):
+        jobs.append(scheduled_text_job if args.scheduled else main.job_text_menu_weather)
+    if args.job in ("photo", "both"):
+        jobs.append(photo_watch_job)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    latencies, errors = [], []
+    drain_seconds, outbox_left, restarted = 0.0, 0, 0
+    started = time.perf_counter()
+    try:
+        for _ in range(args.rounds):
+            reset_caches()
+            # 작업은 스토리를 대기열에 넣기까지만 재고, 업로드는 라운드 끝에 대기열을 비우며 따로 잼
+            main.outbox_uploader.start()
+            for job in jobs:
+                for latency, error in main.run_for_tenants(timed(job), tenants, args.concurrency):
+                    latencies.append(latency)
+                    if error:
+                        errors.append(error)
+            if args.restart:
+                restarted += simulate_restart()
+            drain_started = time.perf_counter()
+            outbox_left += main.outbox_uploader.drain(args.drain_timeout)
+            drain_seconds += time.perf_counter() - drain_started
+    finally:
+        elapsed = time.perf_counter() - started
+        main.outbox_uploader.stop()
+        upstreams.stop()
+
+    report = {
+        "scenario": args.scenario,
+        "tenants": args.tenants,
+        "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "pipeline": args.pipeline + (" (scheduled)" if args.scheduled else ""),
+        "jobs": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_jobs_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_s": round(percentile(latencies, 0.50), 3),
+        "p99_s": round(percentile(latencies, 0.99), 3),
+        "max_s": round(max(latencies, default=0.0), 3),
+        "job_errors": len(errors),
+        "upstream_requests": upstreams.requests,
+        "upstream_injected_errors": upstreams.errors,
+        "upload_drain_s": round(drain_seconds, 3),
+        "outbox_left": outbox_left,
+        **({"restart_interrupted": restarted} if args.restart else {}),
+        "uploads": upstreams.uploads,
+        "upload_bytes": upstreams.upload_bytes,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if args.tracemalloc:
+        report["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    if errors:
+        report["sample_errors"] = sorted(set(errors))[:5]
+    return report
+
+def parse_pairs(values, cast):
+    """["neis=0.5", "kma=1"] -> {"neis": 0.5, "kma": 1.0}"""
+    pairs = {}
+    for value in values or []:
+        name, _, raw = value.partition("=")
+        if name not in UPSTREAM_NAMES:
+            raise SystemExit(f"unknown upstream: {name} (choose from {', '.join(UPSTREAM_NAMES)})")
+        pairs[name] = cast(raw)
+    return pairs
+
+def build_faults(args):
+    settings = {name: dict(SCENARIOS[args.scenario].get(name, {})) for name in UPSTREAM_NAMES}
+    for key, values, cast in (
+        ("latency", args.latency, float),
+        ("jitter", args.jitter, float),
+        ("error_rate", args.error_rate, float),
+        ("oversized", args.oversized, int),
+    ):
+        for name, value in parse_pairs(values, cast).items():
+            settings[name][key] = value
+    for name in args.tls_fail or []:
+        settings[name]["tls_fail"] = True
+    return {name: Fault(**config) for name, config in settings.items()}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="lunchbot 부하/장애 테스트 하네스")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="baseline")
+    parser.add_argument("--tenants", type=int, default=10, help="가짜 학교 수")
+    parser.add_argument("--shared", action="store_true", help="모든 학교가 같은 학교 코드/격자/홈페이지 사용")
+    parser.add_argument("--rounds", type=int, default=1, help="캐시를 비우고 반복할 횟수 (하루 단위 시뮬레이션)")
+    parser.add_argument("--concurrency", type=int, default=main.TENANT_WORKERS, help="동시에 돌릴 작업 수")
+    parser.add_argument("--job", choices=("text", "photo", "both"), default="both")
+    parser.add_argument("--pipeline", choices=("sync", "async"), default=main.PIPELINE_MODE)
+    parser.add_argument("--scheduled", action="store_true", help="07:00 작업을 데몬처럼 스케줄러의 준비/게시 단계로 실행")
+    parser.add_argument("--restart", action="store_true",
+                        help="업로드 도중 같은 pid로 재시작한 데몬처럼 보내던 항목을 남기고 대기열 비우기")
+    parser.add_argument("--render-workers", type=int, default=1, help="작업당 렌더링 프로세스 수")
+    parser.add_argument("--timeout", type=float, help="모든 업스트림 타임아웃(초) 덮어쓰기")
+    parser.add_argument("--upload-interval", type=float, help="같은 계정 스토리 업로드 간격(초) 덮어쓰기")
+    parser.add_argument("--retry-base", type=float, default=0.5, help="업로드 실패 시 첫 재시도 대기(초)")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="라운드마다 대기열을 비우며 기다릴 최대 시간(초)")
+    parser.add_argument("--latency", nargs="*", metavar="NAME=SEC")
+    parser.add_argument("--jitter", nargs="*", metavar="NAME=SEC")
+    parser.add_argument("--error-rate", nargs="*", metavar="NAME=RATE")
+    parser.add_argument("--oversized", nargs="*", metavar="NAME=BYTES")
+    parser.add_argument("--tls-fail", nargs="*", metavar="NAME", choices=UPSTREAM_NAMES)
+    parser.add_argument("--tracemalloc", action="store_true", help="파이썬 할당 최대치도 측정 (느려짐)")
+    parser.add_argument("--max-job-seconds", type=float, help="이보다 오래 걸린 작업이 있으면 종료 코드 1")
+    parser.add_argument("--json", action="store_true", help="보고서를 JSON으로 출력")
+    parser.add_argument("--verbose", action="store_true", help="봇 INFO 로그도 출력")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        main.logger.setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    faults = build_faults(args)
+    cwd = os.getcwd()
+    font_path = os.path.abspath(main.FONT_PATH)
+    workdir = tempfile.mkdtemp(prefix="lunchbot-harness-")
+    os.chdir(workdir)
+    if os.path.exists(font_path):
+        main.FONT_PATH = font_path
+    try:
+        report = run_harness(args, faults)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:26s} {value}")
+    if args.max_job_seconds and report["max_s"] > args.max_job_seconds:
+        print(f"\nFAIL: slowest job took {report['max_s']}s (> {args.max_job_seconds}s)")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
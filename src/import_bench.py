@@ -0,0 +1,112 @@
+"""lunchbot 시작 시간 점검 (python -X importtime 기반)
+
+    python import_bench.py                   # import main 시간, 실행 스크립트 시작 시간과 느린 모듈 출력
+    python import_bench.py --budget-ms 80    # 예산을 넘거나 무거운 의존성이 로드되면 종료 코드 1
+
+짧은 CLI 실행(--genweather 등)과 컨테이너 재시작이 빨라야 하므로 `import main`만으로는
+instagrapi/PIL/httpx/asyncio 같은 무거운 모듈이 로드되지 않아야 한다. 컨테이너는 main.py를 import하는
+lunchbot.py로 시작하므로(.pyc 사용) 그 실행 시간에도 예산을 건다. main.py를 직접 실행하면 매번 다시
+컴파일하므로 참고용으로만 출력한다.
+"""
+import os
+import sys
+import time
+import argparse
+import py_compile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET_MS = 60.0
+DEFAULT_CLI_BUDGET_MS = 150.0  # 인터프리터 시작 포함
+ENTRY_SCRIPT = "lunchbot.py"  # Dockerfile CMD
+# import main 시점에 로드되면 안 되는 모듈 (쓰는 함수 안에서 import)
+LAZY_MODULES = ("instagrapi", "pydantic", "PIL", "httpx", "asyncio", "requests", "bs4", "multiprocessing", "http.server")
+
+def parse_importtime(stderr, target="main"):
+    """-X importtime 출력에서 target의 누적 시간(us)과 target이 로드한 모듈 목록 [(이름, 자체 us, 누적 us, 깊이)]"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        head, cumulative_us, raw_name = line.split("|", 2)
+        self_us = head.split(":", 1)[1]
+        name = raw_name.rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    # 자식 모듈은 부모보다 먼저 출력되므로 target 직전의 최상위 항목 이후가 target의 하위 트리
+    for index, (name, _, cumulative, depth) in enumerate(entries):
+        if name == target and depth == 0:
+            start = index
+            while start > 0 and entries[start - 1][3] > 0:
+                start -= 1
+            return cumulative, entries[start:index]
+    raise RuntimeError(f"{target} not found in -X importtime output")
+
+def measure_import(repeat):
+    """새 인터프리터에서 import main을 repeat번 실행해 (누적 시간 ms 목록, 마지막 실행의 하위 모듈) 반환"""
+    samples, children = [], []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=BENCH_DIR, capture_output=True, text=True,
+        )
+        if proc.returncode:
+            raise RuntimeError(f"import main failed:\n{proc.stderr[-2000:]}")
+        cumulative, children = parse_importtime(proc.stderr)
+        samples.append(cumulative / 1000)
+    return samples, children
+
+def measure_cli(script, repeat):
+    """python <script> --help 실행 시간(ms) 목록 (인터프리터 시작 포함)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, "--help"], cwd=BENCH_DIR, capture_output=True, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def eager_heavy_modules(children):
+    names = {name for name, _, _, _ in children}
+    return sorted(m for m in LAZY_MODULES if any(n == m or n.startswith(m + ".") for n in names))
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="lunchbot import 시간 점검")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="import main 누적 시간 예산(ms, 중앙값)")
+    parser.add_argument("--cli-budget-ms", type=float, default=DEFAULT_CLI_BUDGET_MS,
+                        help=f"{ENTRY_SCRIPT} --help 실행 시간 예산(ms, 중앙값)")
+    parser.add_argument("--repeat", type=int, default=5, help="측정 횟수")
+    parser.add_argument("--top", type=int, default=10, help="출력할 느린 모듈 수")
+    args = parser.parse_args()
+
+    # 이미지 빌드 때처럼 미리 컴파일해 둠 (PYTHONDONTWRITEBYTECODE 환경에서도 .pyc를 쓰도록)
+    py_compile.compile(os.path.join(BENCH_DIR, "main.py"), doraise=True)
+    samples, children = measure_import(args.repeat)
+    entry_samples = measure_cli(ENTRY_SCRIPT, args.repeat)
+    script_samples = measure_cli("main.py", args.repeat)
+    median = statistics.median(samples)
+    entry_median = statistics.median(entry_samples)
+    print(f"{'import main':30s} {median:8.1f} ms  (min {min(samples):.1f} ms, budget {args.budget_ms:.0f} ms)")
+    print(f"{ENTRY_SCRIPT + ' --help (wall)':30s} {entry_median:8.1f} ms  "
+          f"(min {min(entry_samples):.1f} ms, budget {args.cli_budget_ms:.0f} ms)")
+    print(f"{'main.py --help (wall)':30s} {statistics.median(script_samples):8.1f} ms  (소스 재컴파일 포함, 참고용)")
+    print("\nslowest direct imports (cumulative):")
+    direct = sorted((c for c in children if c[3] == 1), key=lambda c: c[2], reverse=True)
+    for name, _, cumulative, _ in direct[:args.top]:
+        print(f"  {name:28s} {cumulative / 1000:8.1f} ms")
+
+    failed = False
+    heavy = eager_heavy_modules(children)
+    if heavy:
+        print(f"\nFAIL: heavy modules imported eagerly by main: {', '.join(heavy)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"\nFAIL: import main took {median:.1f} ms (> {args.budget_ms:.0f} ms)")
+        failed = True
+    if entry_median > args.cli_budget_ms:
+        print(f"\nFAIL: {ENTRY_SCRIPT} --help took {entry_median:.1f} ms (> {args.cli_budget_ms:.0f} ms)")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
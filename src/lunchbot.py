@@ -0,0 +1,12 @@
+"""lunchbot 실행 스크립트
+
+    python lunchbot.py                # 스케줄러(데몬) 모드
+    python lunchbot.py --uploadnow    # main.py와 같은 옵션
+
+main.py를 스크립트로 직접 실행하면 시작할 때마다 소스 전체를 다시 컴파일하므로,
+모듈로 import해서 __pycache__의 .pyc를 쓰도록 하는 얇은 진입점.
+"""
+from main import main
+
+if __name__ == "__main__":
+    main()
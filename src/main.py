@@ -1,19 +1,28 @@
 import os
-import requests
 import argparse
-import schedule
 import time
+import sys
+import random
+import io
+import tempfile
 import re
 import logging
+import json
+import calendar
+import hashlib
+import sqlite3
+import threading
+import contextvars
 from datetime import datetime, timedelta
-from instagrapi import Client
-from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
-from collections import Counter
-from bs4 import BeautifulSoup
-import urllib3
-import httpx
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from collections import OrderedDict
+from functools import lru_cache, partial
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, parse_qsl
+# instagrapi, PIL, httpx, asyncio 등 무거운 모듈은 실제로 쓰는 함수 안에서 import
+# (--genweather 같은 짧은 실행과 컨테이너 재시작이 쓰지 않는 의존성을 로드하지 않도록)
 
 # =========================
 # 환경 변수 및 상수 설정
@@ -27,11 +36,73 @@ NX = os.getenv("NX")  # 학교 좌표 X
 NY = os.getenv("NY")  # 학교 좌표 Y
 
 IG_CREDENTIAL_PATH = "./ig_settings.json"
+IG_SESSION_CHECK_INTERVAL = int(os.getenv("IG_SESSION_CHECK_INTERVAL", "600"))  # 세션 재확인 간격(초)
 IG_IMAGE_PATH = "./menu"
 FONT_PATH = "font.ttf"
+STORY_MARGIN = 60  # 스토리 이미지 가장자리 여백(px)
+STORY_MAX_BYTES = int(os.getenv("STORY_MAX_BYTES", str(500 * 1024)))  # 스토리 JPEG 최대 크기(바이트)
+STORY_ARCHIVE = os.getenv("STORY_ARCHIVE", "0") == "1"  # 업로드한 스토리를 보관소(ARCHIVE_PATH)에 보관할지
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "./archive")  # 스토리/급식 사진 보관소 (내용 해시로 저장)
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "180"))  # 보관 기간(일)
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", str(512 * 1024 * 1024)))  # 보관소 최대 크기
+PHOTO_DHASH_DISTANCE = 6  # 이 비트 수 이하로 다른 급식 사진은 같은 사진으로 취급
+WORKDIR_KEEP_DAYS = 2  # IG_IMAGE_PATH에 남겨 둘 작업 파일 기간(일)
+STORY_SPOOL_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None  # 업로드 직전 임시 파일 위치 (tmpfs)
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(20 * 1024 * 1024)))  # 급식 사진 최대 다운로드 크기
+PHOTO_CHUNK_SIZE = 64 * 1024
+PHOTO_THUMB_CACHE_SIZE = 8
+PHOTO_WATCH_LEAD_MINUTES = int(os.getenv("PHOTO_WATCH_LEAD_MINUTES", "60"))  # 예상 게시 시각 몇 분 전부터 급식 사진 감시
+PHOTO_WATCH_CUTOFF = os.getenv("PHOTO_WATCH_CUTOFF", "14:00")  # 이 시각까지 사진이 없으면 그날 사진 스토리 포기
+PHOTO_WATCH_HOT_MINUTES = 20  # 예상 게시 시각 앞뒤 이 구간은 가장 짧은 간격으로 확인
+PHOTO_POLL_MIN = 60  # 급식 사진 확인 간격(초)
+PHOTO_POLL_MAX = 600
+STORY_UPLOAD_INTERVAL = float(os.getenv("STORY_UPLOAD_INTERVAL", "10"))  # 같은 계정에 스토리를 연달아 올릴 때 최소 간격(초)
+WARMUP_MINUTES = int(os.getenv("WARMUP_MINUTES", "10"))  # 업로드 몇 분 전에 미리 가져오기/렌더링할지
+SCHEDULER_MAX_SLEEP = 900  # 스케줄러가 한 번에 잠드는 최대 시간(초)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0"))  # 일괄 렌더링 프로세스 수 (0: CPU 코어 수)
+RENDER_TIMEOUT = int(os.getenv("RENDER_TIMEOUT", "120"))  # 렌더링 프로세스 결과를 기다리는 최대 시간(초), 넘으면 직접 렌더링
+PREPARE_WAIT = int(os.getenv("PREPARE_WAIT", "180"))  # 마감 시각에 준비 단계를 더 기다리는 최대 시간(초), 넘으면 다시 준비
+CACHE_PATH = "./cache"
+TEMPLATE_VERSION = 1  # 스토리 레이아웃을 바꾸면 올려서 렌더링 캐시를 무효화
+FINGERPRINT_PATH = f"{CACHE_PATH}/fingerprints.db"  # 날짜별 업로드 기록 (SQLite)
+RENDER_CACHE_PATH = f"{CACHE_PATH}/stories"  # 입력 지문별 렌더링 결과
+FINGERPRINT_KEEP_DAYS = 7
+FORECAST_DB_PATH = f"{CACHE_PATH}/forecast.db"  # 초단기예보 시계열 저장소 (SQLite)
+FORECAST_KEEP_DAYS = 14  # 예보 항목 보관 기간(일)
+PHOTO_WATCH_STATE_PATH = f"{CACHE_PATH}/photo_watch.json"  # 학교별 마지막으로 게시한 급식 사진
+MEAL_HISTORY_PATH = f"{CACHE_PATH}/meals.db"  # 지난 식단 검색 색인 (SQLite)
+OUTBOX_PATH = f"{CACHE_PATH}/outbox.db"  # 업로드 대기열 (SQLite)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))  # 이 횟수만큼 실패하면 포기
+OUTBOX_RETRY_BASE = 30  # 첫 재시도 대기(초), 실패할 때마다 두 배
+OUTBOX_RETRY_MAX = 1800
+OUTBOX_THROTTLE_DELAY = 900  # 인스타그램이 잠시 기다리라고 하면 최소 이만큼 쉼(초)
+OUTBOX_DRAIN_TIMEOUT = int(os.getenv("OUTBOX_DRAIN_TIMEOUT", "900"))  # 1회 실행 명령이 업로드를 기다리는 최대 시간(초)
+OUTBOX_KEEP_DAYS = 7  # 끝난 항목 기록 보관 기간(일)
+OUTBOX_LEASE = 600  # 보내는 중인 항목을 다른 프로세스가 되찾기 전까지 기다리는 시간(초)
+
+# 나이스 교육정보 개방 포털 (급식식단정보)
+NEIS_OFFICE_CODE = os.getenv("NEIS_OFFICE_CODE", "B10")  # 서울특별시교육청
+NEIS_SCHOOL_CODE = os.getenv("NEIS_SCHOOL_CODE", "7010208")  # 양정고등학교
+NEIS_PAGE_SIZE = 100
+MEAL_CACHE_TTL = int(os.getenv("MEAL_CACHE_TTL", "21600"))  # 월별 식단 캐시 갱신 주기(초)
+MEAL_MISS_REFRESH = int(os.getenv("MEAL_MISS_REFRESH", "600"))  # 캐시에 없는 가까운 날짜 식단을 다시 받아 보는 최소 간격(초)
+MEAL_MISS_WINDOW_DAYS = 7  # 오늘 앞뒤 이 기간의 식단이 캐시에 없으면 바로 다시 받아 봄
+MEAL_ROW_FIELDS = ("MLSV_YMD", "MMEAL_SC_CODE", "MMEAL_SC_NM", "DDISH_NM", "CAL_INFO", "NTR_INFO", "ORPLC_INFO")
 
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
 HEADERS = {"User-Agent": USER_AGENT}
+SCHOOL_HOMEPAGE_URL = "https://yangchung.sen.hs.kr"
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sync")  # sync | async (07:00 작업 실행 방식)
+DEFAULT_TENANT_NAME = "default"
+TENANTS_PATH = os.getenv("TENANTS_PATH", "./tenants.json")  # 여러 학교 설정 파일 (없으면 환경 변수의 학교 하나)
+TENANT_WORKERS = int(os.getenv("TENANT_WORKERS", "4"))  # 학교별 작업을 동시에 돌릴 최대 스레드 수
+METRICS_PATH = os.getenv("METRICS_PATH", f"{CACHE_PATH}/metrics.jsonl")  # span 기록 파일 (빈 값이면 기록 안 함)
+METRICS_MAX_BYTES = int(os.getenv("METRICS_MAX_BYTES", str(16 * 1024 * 1024)))  # 넘으면 .1로 넘기고 새 파일에 기록
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # /metrics 엔드포인트 포트 (0이면 끔)
+STORY_SERVER_HOST = os.getenv("STORY_SERVER_HOST", "127.0.0.1")
+STORY_SERVER_PORT = int(os.getenv("STORY_SERVER_PORT", "0"))  # 로컬 스토리 API 포트 (0이면 --serve에서만 8080으로 켬)
+STORY_CACHE_BYTES = int(os.getenv("STORY_CACHE_BYTES", str(64 * 1024 * 1024)))  # 서비스 모드 스토리 메모리 캐시 크기
 
 # =========================
 # 로깅 설정
@@ -43,132 +114,888 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# =========================
+# 계측 (span, 지표)
+# =========================
+class Metrics:
+    """카운터와 소요 시간 합계를 모아 Prometheus 텍스트 형식으로 내보냄"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (이름, 라벨) -> 값
+        self._timings = {}   # (이름, 라벨) -> [횟수, 합계(초)]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            entry = self._timings.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def render(self):
+        def fmt(name, labels, value):
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(fmt(name, labels, value))
+            for (name, labels), (count, total) in sorted(self._timings.items()):
+                lines.append(fmt(f"{name}_count", labels, count))
+                lines.append(fmt(f"{name}_sum", labels, f"{total:.6f}"))
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+_trace_lock = threading.Lock()
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+def write_trace(record):
+    """span/작업 기록을 METRICS_PATH에 JSON 한 줄로 추가 (METRICS_MAX_BYTES를 넘으면 이전 파일 하나만 남기고 교체)"""
+    if not METRICS_PATH:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    try:
+        with _trace_lock:
+            os.makedirs(os.path.dirname(METRICS_PATH) or ".", exist_ok=True)
+            with open(METRICS_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                size = f.tell()
+            if size > METRICS_MAX_BYTES:
+                os.replace(METRICS_PATH, f"{METRICS_PATH}.1")
+    except OSError as e:
+        logger.debug(f"Trace write failed: {e}")
+
+@contextmanager
+def span(name, **attrs):
+    """구간 소요 시간 기록 (yield한 dict에 bytes 등 속성을 추가할 수 있음)"""
+    record = {"span": name, **attrs}
+    parent = _current_span.get()
+    if parent is not None:
+        record["parent"] = parent["span"]
+    job = _current_job.get()
+    if job is not None:
+        record["job"] = job["name"]
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_span.reset(token)
+        record["ts"] = datetime.now().isoformat(timespec="milliseconds")
+        record["duration_ms"] = round(elapsed * 1000, 2)
+        metrics.observe("lunchbot_span_seconds", elapsed, span=name)
+        if job is not None:
+            job["spans"].append(record)
+        write_trace(record)
+
+def count_cache(cache, hit):
+    """캐시 적중/실패 횟수 기록"""
+    metrics.inc("lunchbot_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+@contextmanager
+def job_trace(name):
+    """작업 하나 동안의 span을 모아 끝날 때 단계별 요약을 로그로 남김"""
+    job = {"name": name, "spans": []}
+    token = _current_job.set(job)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield job
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_job.reset(token)
+        metrics.observe("lunchbot_job_seconds", elapsed, job=name, status=status)
+        stages = {}
+        for record in job["spans"]:
+            stage = stages.setdefault(record["span"], {"count": 0, "ms": 0.0, "bytes": 0, "retries": 0, "errors": 0})
+            stage["count"] += 1
+            stage["ms"] += record["duration_ms"]
+            stage["bytes"] += record.get("bytes") or 0
+            stage["retries"] += record.get("retries", 0)
+            stage["errors"] += "error" in record
+        write_trace({"job": name, "status": status, "duration_ms": round(elapsed * 1000, 2),
+                     "ts": datetime.now().isoformat(timespec="milliseconds"), "stages": stages})
+        parts = [f"{stage} {v['count']}x {v['ms']:.0f}ms" + (f" {v['bytes']}B" if v["bytes"] else "")
+                 + (f" {v['retries']} retry" if v["retries"] else "")
+                 + (f" {v['errors']} err" if v["errors"] else "") for stage, v in stages.items()]
+        logger.info(f"Job summary [{name}] {status} {elapsed * 1000:.0f}ms | " + " | ".join(parts))
+
+def metrics_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+def start_metrics_server(port=None, host=None):
+    """Prometheus 형식 /metrics 엔드포인트를 백그라운드 스레드로 시작"""
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host or METRICS_HOST, port), metrics_handler())
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics endpoint: http://{host or METRICS_HOST}:{port}/metrics")
+    return server
+
+# =========================
+# 공용 HTTP 전송 계층
+# =========================
+# 호스트별 설정: 타임아웃(초), 재시도 횟수, 인증서 검증 여부
+# 초당 요청 수(rate)와 순간 허용량(burst)으로 호스트별 요청 속도 제한
+UPSTREAMS = {
+    "open.neis.go.kr": {"timeout": 10, "retries": 3, "verify": True, "rate": 5, "burst": 5},
+    "apis.data.go.kr": {"timeout": 10, "retries": 3, "verify": True, "rate": 10, "burst": 10},
+    # 학교 홈페이지는 인증서 체인이 불완전해서 검증하지 않음
+    "yangchung.sen.hs.kr": {"timeout": 10, "retries": 2, "verify": False, "rate": 2, "burst": 2},
+}
+DEFAULT_UPSTREAM = {"timeout": 15, "retries": 2, "verify": True, "rate": 5, "burst": 5}
+RETRY_BACKOFF_BASE = 0.5   # 재시도 대기 기본값(초), 시도마다 2배 + 지터
+RETRY_BACKOFF_MAX = 8.0
+CIRCUIT_FAILURE_THRESHOLD = 5  # 연속 실패 시 회로 차단
+CIRCUIT_COOLDOWN = 60          # 차단 유지 시간(초), 이후 시험 요청 하나만 허용
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 호스트 -> 대체 주소 (부하/장애 테스트용 가짜 서버, 예: {"open.neis.go.kr": "http://127.0.0.1:8080/neis"})
+UPSTREAM_OVERRIDES = json.loads(os.getenv("UPSTREAM_OVERRIDES", "{}"))
+
+class CircuitOpenError(Exception):
+    """연속 실패로 해당 호스트 요청이 일시 차단된 상태"""
+
+class RateLimiter:
+    """토큰 버킷: 기다려야 할 시간(초)을 예약해서 돌려줌"""
+    def __init__(self, rate, burst):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+class HttpTransport:
+    """모든 외부 요청이 공유하는 HTTP 계층
+
+    호스트별 keep-alive 연결 풀, 호스트별 타임아웃/인증서 검증 정책,
+    지터가 있는 지수 백오프 재시도, 서킷 브레이커를 제공한다.
+    """
+    def __init__(self, upstreams=None, overrides=None):
+        self._upstreams = upstreams if upstreams is not None else UPSTREAMS
+        self.overrides = overrides if overrides is not None else dict(UPSTREAM_OVERRIDES)
+        self._lock = threading.Lock()
+        self._clients = {}   # host -> httpx.Client
+        self._breakers = {}  # host -> [연속 실패 수, 차단 시작 시각, 시험 요청 시작 시각(반개방)]
+        self._limiters = {}  # host -> RateLimiter
+
+    def config(self, host):
+        return {**DEFAULT_UPSTREAM, **self._upstreams.get(host, {})}
+
+    def resolve(self, url):
+        """대체 주소가 설정된 호스트면 요청 URL만 바꿈 (설정/서킷/속도 제한은 원래 호스트 기준)"""
+        if not self.overrides:
+            return url
+        parsed = urlsplit(url)
+        base = self.overrides.get(parsed.hostname)
+        if not base:
+            return url
+        return base.rstrip("/") + (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+
+    def client_options(self, host):
+        import httpx
+        cfg = self.config(host)
+        return dict(
+            headers=HEADERS,
+            verify=cfg["verify"],
+            timeout=httpx.Timeout(cfg["timeout"], connect=min(5, cfg["timeout"])),
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+            follow_redirects=True,
+        )
+
+    def _client(self, host):
+        import httpx
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                client = self._clients[host] = httpx.Client(**self.client_options(host))
+            return client
+
+    def rate_limit_delay(self, host):
+        """호스트별 속도 제한 때문에 기다려야 할 시간(초)"""
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                cfg = self.config(host)
+                limiter = self._limiters[host] = RateLimiter(cfg["rate"], cfg["burst"])
+        return limiter.reserve()
+
+    def before_request(self, host):
+        with self._lock:
+            failures, opened_at, probe_at = self._breakers.get(host, (0, 0.0, None))
+            if failures >= CIRCUIT_FAILURE_THRESHOLD:
+                now = time.monotonic()
+                if now - opened_at < CIRCUIT_COOLDOWN:
+                    raise CircuitOpenError(f"{host} 요청이 일시 차단되었습니다 (연속 실패 {failures}회)")
+                # 반개방: 시험 요청 하나만 보내고 결과가 나올 때까지 나머지는 계속 차단
+                # (결과를 기록하지 못한 시험 요청이 있어도 CIRCUIT_COOLDOWN 뒤에는 다시 시험)
+                if probe_at is not None and now - probe_at < CIRCUIT_COOLDOWN:
+                    raise CircuitOpenError(f"{host} 시험 요청 결과를 기다리는 중이라 일시 차단되었습니다")
+                self._breakers[host] = [failures, opened_at, now]
+
+    def record_result(self, host, ok):
+        with self._lock:
+            if ok:
+                self._breakers.pop(host, None)
+                return
+            failures, _, probe_at = self._breakers.get(host, (0, 0.0, None))
+            failures += 1
+            # 실패하면(시험 요청 실패 포함) 차단 시각을 새로 잡고 다시 CIRCUIT_COOLDOWN 동안 차단
+            self._breakers[host] = [failures, time.monotonic(), None]
+            if failures == CIRCUIT_FAILURE_THRESHOLD or probe_at is not None:
+                logger.warning(f"Circuit opened for {host} ({failures} consecutive failures)")
+
+    @staticmethod
+    def backoff(attempt):
+        delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _attempts(self, url, record=None):
+        host = urlsplit(url).hostname
+        retries = self.config(host)["retries"]
+        for attempt in range(retries + 1):
+            if attempt:
+                metrics.inc("lunchbot_http_retries_total", host=host)
+                if record is not None:
+                    record["retries"] = attempt
+            self.before_request(host)
+            yield host, attempt, attempt == retries
+
+    @staticmethod
+    def observe(record, resp, nbytes=None):
+        """응답 상태와 받은 바이트 수를 span과 지표에 기록"""
+        nbytes = resp.num_bytes_downloaded if nbytes is None else nbytes
+        record["status"] = resp.status_code
+        record["bytes"] = nbytes
+        metrics.inc("lunchbot_http_requests_total", host=record["host"], status=resp.status_code)
+        metrics.inc("lunchbot_http_bytes_total", nbytes, host=record["host"])
+
+    def request(self, method, url, headers=None, **kwargs):
+        """재시도/서킷 브레이커를 거쳐 요청하고 응답 반환 (본문은 모두 읽음)"""
+        with span("http", method=method, host=urlsplit(url).hostname) as record:
+            resp = self._request(method, url, record, headers=headers, **kwargs)
+            self.observe(record, resp, len(resp.content))
+            return resp
+
+    def _request(self, method, url, record, headers=None, **kwargs):
+        import httpx
+        for host, attempt, last in self._attempts(url, record):
+            time.sleep(self.rate_limit_delay(host))
+            try:
+                resp = self._client(host).request(method, self.resolve(url), headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                self.record_result(host, False)
+                if last:
+                    raise
+                logger.warning(f"{method} {host} 실패 ({e!r}), 재시도 {attempt + 1}")
+                time.sleep(self.backoff(attempt))
+                continue
+            if resp.status_code in RETRY_STATUS_CODES:
+                self.record_result(host, False)
+                if not last:
+                    logger.warning(f"{method} {host} 응답 {resp.status_code}, 재시도 {attempt + 1}")
+                    time.sleep(self.backoff(attempt))
+                    continue
+            else:
+                self.record_result(host, True)
+            return resp
+
+    def get(self, url, headers=None, **kwargs):
+        return self.request("GET", url, headers=headers, **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, headers=None, **kwargs):
+        """본문을 스트리밍으로 읽는 요청 (응답 헤더를 받기 전까지만 재시도)"""
+        with span("http", method=method, host=urlsplit(url).hostname, stream=True) as record:
+            with self._stream(method, url, record, headers=headers, **kwargs) as resp:
+                try:
+                    yield resp
+                finally:
+                    self.observe(record, resp)
+
+    @contextmanager
+    def _stream(self, method, url, record, headers=None, **kwargs):
+        import httpx
+        for host, attempt, last in self._attempts(url, record):
+            time.sleep(self.rate_limit_delay(host))
+            try:
+                ctx = self._client(host).stream(method, self.resolve(url), headers=headers, **kwargs)
+                resp = ctx.__enter__()
+            except httpx.TransportError as e:
+                self.record_result(host, False)
+                if last:
+                    raise
+                logger.warning(f"{method} {host} 실패 ({e!r}), 재시도 {attempt + 1}")
+                time.sleep(self.backoff(attempt))
+                continue
+            if resp.status_code in RETRY_STATUS_CODES and not last:
+                self.record_result(host, False)
+                ctx.__exit__(None, None, None)
+                logger.warning(f"{method} {host} 응답 {resp.status_code}, 재시도 {attempt + 1}")
+                time.sleep(self.backoff(attempt))
+                continue
+            self.record_result(host, resp.status_code not in RETRY_STATUS_CODES)
+            try:
+                yield resp
+            finally:
+                ctx.__exit__(*sys.exc_info())
+            return
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+class AsyncHttpSession:
+    """이벤트 루프 하나에서 쓰는 비동기 버전 (설정/서킷 상태는 HttpTransport와 공유)"""
+    def __init__(self, transport):
+        self._transport = transport
+        self._clients = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def _client(self, host):
+        import httpx
+        client = self._clients.get(host)
+        if client is None:
+            client = self._clients[host] = httpx.AsyncClient(**self._transport.client_options(host))
+        return client
+
+    async def get(self, url, headers=None, **kwargs):
+        with span("http", method="GET", host=urlsplit(url).hostname) as record:
+            resp = await self._get(url, record, headers=headers, **kwargs)
+            self._transport.observe(record, resp, len(resp.content))
+            return resp
+
+    async def _get(self, url, record, headers=None, **kwargs):
+        import asyncio
+        import httpx
+        t = self._transport
+        for host, attempt, last in t._attempts(url, record):
+            await asyncio.sleep(t.rate_limit_delay(host))
+            try:
+                resp = await self._client(host).get(t.resolve(url), headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                t.record_result(host, False)
+                if last:
+                    raise
+                logger.warning(f"GET {host} 실패 ({e!r}), 재시도 {attempt + 1}")
+                await asyncio.sleep(t.backoff(attempt))
+                continue
+            ok = resp.status_code not in RETRY_STATUS_CODES
+            t.record_result(host, ok)
+            if not ok and not last:
+                logger.warning(f"GET {host} 응답 {resp.status_code}, 재시도 {attempt + 1}")
+                await asyncio.sleep(t.backoff(attempt))
+                continue
+            return resp
+
+    @asynccontextmanager
+    async def stream(self, method, url, headers=None, **kwargs):
+        with span("http", method=method, host=urlsplit(url).hostname, stream=True) as record:
+            async with self._stream(method, url, record, headers=headers, **kwargs) as resp:
+                try:
+                    yield resp
+                finally:
+                    self._transport.observe(record, resp)
+
+    @asynccontextmanager
+    async def _stream(self, method, url, record, headers=None, **kwargs):
+        import asyncio
+        import httpx
+        t = self._transport
+        for host, attempt, last in t._attempts(url, record):
+            await asyncio.sleep(t.rate_limit_delay(host))
+            try:
+                ctx = self._client(host).stream(method, t.resolve(url), headers=headers, **kwargs)
+                resp = await ctx.__aenter__()
+            except httpx.TransportError as e:
+                t.record_result(host, False)
+                if last:
+                    raise
+                logger.warning(f"{method} {host} 실패 ({e!r}), 재시도 {attempt + 1}")
+                await asyncio.sleep(t.backoff(attempt))
+                continue
+            ok = resp.status_code not in RETRY_STATUS_CODES
+            t.record_result(host, ok)
+            if not ok and not last:
+                await ctx.__aexit__(None, None, None)
+                logger.warning(f"{method} {host} 응답 {resp.status_code}, 재시도 {attempt + 1}")
+                await asyncio.sleep(t.backoff(attempt))
+                continue
+            try:
+                yield resp
+            finally:
+                await ctx.__aexit__(*sys.exc_info())
+            return
+
+http_transport = HttpTransport()
+
+# =========================
+# 학교(테넌트) 설정
+# =========================
+class Tenant:
+    """봇을 돌리는 학교 하나: 나이스 학교 코드, 기상청 격자, 인스타그램 계정, 스케줄"""
+    def __init__(self, name, neis_office_code, neis_school_code, nx, ny, ig_username, ig_password,
+                 ig_settings_path=None, homepage_url=None, text_time="07:00", photo_time="11:50",
+                 photo_cutoff=None):
+        self.name = name
+        self.neis_office_code = neis_office_code
+        self.neis_school_code = neis_school_code
+        self.nx = nx
+        self.ny = ny
+        self.ig_username = ig_username
+        self.ig_password = ig_password
+        self.ig_settings_path = ig_settings_path or f"./ig_settings_{name}.json"
+        self.homepage_url = homepage_url
+        self.text_time = text_time
+        self.photo_time = photo_time  # 급식 사진이 올라올 것으로 예상되는 시각
+        self.photo_cutoff = photo_cutoff or PHOTO_WATCH_CUTOFF
+
+    @property
+    def image_dir(self):
+        # 기본 학교는 기존 경로(./menu)를 그대로 사용
+        if self.name == DEFAULT_TENANT_NAME:
+            return IG_IMAGE_PATH
+        return f"{IG_IMAGE_PATH}/{self.name}"
+
+    @classmethod
+    def from_dict(cls, data):
+        """tenants.json 항목에서 생성 (*_env 키는 환경 변수에서 값을 읽음)"""
+        data = dict(data)
+        for key in ("ig_username", "ig_password"):
+            env_key = data.pop(f"{key}_env", None)
+            if env_key:
+                data[key] = os.getenv(env_key)
+        schedule = data.pop("schedule", {})
+        data.setdefault("text_time", schedule.get("text", "07:00"))
+        data.setdefault("photo_time", schedule.get("photo", "11:50"))
+        data.setdefault("photo_cutoff", schedule.get("photo_cutoff"))
+        return cls(**data)
+
+def default_tenant():
+    """환경 변수로 설정하는 기존 단일 학교 구성"""
+    return Tenant(
+        DEFAULT_TENANT_NAME, NEIS_OFFICE_CODE, NEIS_SCHOOL_CODE, NX, NY,
+        IG_USERNAME, IG_PASSWORD, IG_CREDENTIAL_PATH, SCHOOL_HOMEPAGE_URL,
+    )
+
+def load_tenants(path=None):
+    """TENANTS_PATH(JSON 목록)가 있으면 여러 학교, 없으면 기본 학교 하나"""
+    path = path or TENANTS_PATH
+    if not os.path.exists(path):
+        return [DEFAULT_TENANT]
+    with open(path, encoding="utf-8") as f:
+        tenants = [Tenant.from_dict(item) for item in json.load(f)]
+    for tenant in tenants:
+        _tenants[tenant.name] = tenant
+    return tenants
+
+DEFAULT_TENANT = default_tenant()
+_tenants = {DEFAULT_TENANT_NAME: DEFAULT_TENANT}  # 이름 -> Tenant (업로더가 대기열 항목의 계정을 찾을 때 사용)
+
+def get_tenant(name):
+    tenant = _tenants.get(name)
+    if tenant is None:
+        raise KeyError(f"unknown tenant: {name}")
+    return tenant
+
+class TenantJobError(Exception):
+    """학교별 작업 중 실패한 것이 있음 (failures: [(학교 이름, 예외)])"""
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(", ".join(f"{name}: {e!r}" for name, e in failures))
+
+def run_for_tenants(func, tenants, max_workers=None):
+    """학교별 작업을 제한된 크기의 스레드 풀에서 동시에 실행
+
+    학교 수와 상관없이 실패한 학교는 로그를 남기고 나머지는 끝까지 돌린 뒤 TenantJobError로 알린다.
+    """
+    tenants = list(tenants)
+    if len(tenants) == 1:
+        calls = [(tenants[0], partial(func, tenants[0]))]
+        pool = None
+    else:
+        pool = ThreadPoolExecutor(max_workers=max_workers or TENANT_WORKERS, thread_name_prefix="tenant")
+        calls = [(tenant, pool.submit(func, tenant).result) for tenant in tenants]
+    results, failures = [], []
+    try:
+        for tenant, call in calls:
+            try:
+                results.append(call())
+            except Exception as e:
+                logger.error(f"[{tenant.name}] {getattr(func, '__name__', func)} failed: {e}", exc_info=True)
+                failures.append((tenant.name, e))
+                results.append(None)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if failures:
+        raise TenantJobError(failures) from failures[0][1]
+    return results
+
 # =========================
 # 인스타그램 봇 클래스
 # =========================
 class InstagramBot:
-    """인스타그램 스토리 업로드용 봇"""
-    def __init__(self):
+    """인스타그램 스토리 업로드용 봇 (저장된 세션 재사용)"""
+    def __init__(self, username=None, password=None, settings_path=None):
+        from instagrapi import Client
+        self._username = username or IG_USERNAME
+        self._password = password or IG_PASSWORD
+        self._settings_path = settings_path or IG_CREDENTIAL_PATH
         self._cl = Client()
-        if os.path.exists(IG_CREDENTIAL_PATH):
-            self._cl.load_settings(IG_CREDENTIAL_PATH)
-        self._cl.login(IG_USERNAME, IG_PASSWORD)
-        self._cl.dump_settings(IG_CREDENTIAL_PATH)
-
-    def upload_story(self, image_path: str):
-        logger.info(f"Uploading story: {image_path}")
-        self._cl.photo_upload_to_story(image_path)
+        self._saved_settings = None
+        self._last_checked = 0.0
+        self.username = self._username
+        if os.path.exists(self._settings_path):
+            self._cl.load_settings(self._settings_path)
+            self._saved_settings = self._cl.get_settings()
+        self.ensure_login()
+
+    def ensure_login(self, force=False):
+        """세션이 유효한지 확인하고 만료된 경우에만 다시 로그인"""
+        from instagrapi.exceptions import LoginRequired
+        now = time.monotonic()
+        if not force and self._last_checked and now - self._last_checked < IG_SESSION_CHECK_INTERVAL:
+            return
+        if not force and self._saved_settings:
+            try:
+                # 저장된 세션으로 가벼운 요청을 보내 유효성 확인
+                self._cl.get_timeline_feed()
+                self._last_checked = now
+                logger.info("Instagram session reused.")
+                return
+            except LoginRequired:
+                logger.info("Instagram session expired, logging in again.")
+        self._relogin()
+        self._last_checked = time.monotonic()
+
+    def _relogin(self):
+        old_settings = self._cl.get_settings()
+        if old_settings.get("uuids"):
+            # 기기 정보는 유지해야 새 기기 로그인 챌린지를 피할 수 있음
+            self._cl.set_settings({})
+            self._cl.set_uuids(old_settings["uuids"])
+        self._cl.login(self._username, self._password)
+        logger.info("Instagram login completed.")
+        self._save_settings()
+
+    def _save_settings(self):
+        """세션 설정이 바뀐 경우에만 ig_settings.json 갱신"""
+        settings = self._cl.get_settings()
+        if settings == self._saved_settings:
+            return
+        self._cl.dump_settings(self._settings_path)
+        self._saved_settings = settings
+        logger.info(f"Instagram settings saved: {self._settings_path}")
+
+    def upload_story(self, story):
+        """스토리 업로드 (파일 경로 또는 메모리에서 인코딩된 JPEG 바이트)"""
+        with span("upload", account=self.username) as record:
+            if isinstance(story, bytes):
+                record["bytes"] = len(story)
+                # instagrapi는 경로만 받으므로 tmpfs에 잠깐 내려 놓고 바로 지움
+                with tempfile.NamedTemporaryFile(suffix=".jpg", dir=STORY_SPOOL_DIR, delete=False) as f:
+                    f.write(story)
+                try:
+                    logger.info(f"Uploading story: <memory {len(story)} bytes>")
+                    self._upload(f.name)
+                finally:
+                    os.remove(f.name)
+            else:
+                logger.info(f"Uploading story: {story}")
+                self._upload(story)
+        metrics.inc("lunchbot_uploads_total", account=self.username)
         logger.info("Story uploaded successfully.")
 
+    def _upload(self, image_path):
+        from instagrapi.exceptions import LoginRequired
+        try:
+            self._cl.photo_upload_to_story(image_path)
+        except LoginRequired:
+            # 업로드 도중 세션이 끊긴 경우 한 번만 재로그인 후 재시도
+            logger.warning("Instagram session expired during upload, retrying after login.")
+            self.ensure_login(force=True)
+            self._cl.photo_upload_to_story(image_path)
+        self._save_settings()
+
+_ig_bots = {}  # 인스타그램 계정 -> InstagramBot
+_ig_bot_lock = threading.Lock()
+
+def get_instagram_bot(tenant=None):
+    """프로세스 전체에서 계정별로 공유하는 로그인된 InstagramBot 반환"""
+    tenant = tenant or DEFAULT_TENANT
+    with _ig_bot_lock:
+        bot = _ig_bots.get(tenant.ig_username)
+        if bot is None:
+            bot = _ig_bots[tenant.ig_username] = InstagramBot(
+                tenant.ig_username, tenant.ig_password, tenant.ig_settings_path
+            )
+        else:
+            bot.ensure_login()
+        return bot
+
 # =========================
 # 날씨 데이터 관련 함수
 # =========================
-def get_weather_data():
-    """기상청 초단기예보 API에서 오늘의 날씨 데이터 가져오기"""
-    now = datetime.now()
-    try:
-        # API 요청 시간 계산
-        adjusted_time = now - timedelta(minutes=40)
-        base_hour = adjusted_time.hour
-        base_minute = 30 if adjusted_time.minute >= 30 else 0
-        base_time_dt = adjusted_time.replace(minute=base_minute, second=0, microsecond=0)
-        if adjusted_time.minute < 30:
-            base_time_dt = base_time_dt - timedelta(hours=1)
-        base_date = base_time_dt.strftime("%Y%m%d")
-        base_time = base_time_dt.strftime("%H%M")
-
-        url = (
-            f'http://apis.data.go.kr/1360000/VilageFcstInfoService_2.0/getUltraSrtFcst?'
-            f'serviceKey={WEATHER_API_KEY}&pageNo=1&numOfRows=1000&dataType=JSON'
-            f'&base_date={base_date}&base_time=0630&nx={NX}&ny={NY}'
-        )
-        logger.debug(f"요청 URL: {url}")
+def get_forecast_base(now):
+    """현재 시각 기준으로 조회 가능한 가장 최근 초단기예보 발표 일자/시각 (매시 30분 발표, 45분 이후 제공)"""
+    adjusted_time = now - timedelta(minutes=15)
+    base_time_dt = adjusted_time.replace(minute=30, second=0, microsecond=0)
+    if adjusted_time.minute < 30:
+        base_time_dt = base_time_dt - timedelta(hours=1)
+    return base_time_dt.strftime("%Y%m%d"), base_time_dt.strftime("%H%M")
+
+def next_forecast_release(now):
+    """다음 초단기예보가 조회 가능해지는 시각 (매시 30분 발표, 45분 이후 제공)"""
+    release = now.replace(minute=45, second=0, microsecond=0)
+    if release <= now:
+        release += timedelta(hours=1)
+    return release
+
+def forecast_url(base_date, base_time, nx, ny):
+    return (
+        f'http://apis.data.go.kr/1360000/VilageFcstInfoService_2.0/getUltraSrtFcst?'
+        f'serviceKey={WEATHER_API_KEY}&pageNo=1&numOfRows=1000&dataType=JSON'
+        f'&base_date={base_date}&base_time={base_time}&nx={nx}&ny={ny}'
+    )
 
-        response = requests.get(url)
+def fetch_forecast(base_date, base_time, nx, ny):
+    """기상청 초단기예보 원본 응답(JSON) 요청"""
+    url = forecast_url(base_date, base_time, nx, ny)
+    logger.debug(f"요청 URL: {url}")
+    with span("fetch.forecast", base=f"{base_date}{base_time}"):
+        response = http_transport.get(url)
         response.raise_for_status()
-        data = response.json()
-
-        # 응답 구조 확인
-        items = (
-            data.get('response', {})
-                .get('body', {})
-                .get('items', {})
-                .get('item', [])
-        )
+        return response.json()
+
+def forecast_items(data):
+    """초단기예보 원본 응답에서 item 목록 추출"""
+    return (
+        data.get('response', {})
+            .get('body', {})
+            .get('items', {})
+            .get('item', [])
+    )
+
+# 예보 시각마다 가장 최근 발표의 값만 고름 (SQLite는 MAX()와 함께 쓴 열을 최댓값 행에서 가져옴)
+LATEST_FORECAST_SQL = """
+WITH latest AS (
+    SELECT fcst, category, value, MAX(base) AS base
+    FROM forecast
+    WHERE nx = ? AND ny = ? AND fcst >= ? AND fcst < ?
+    GROUP BY fcst, category
+)
+"""
+# 하늘 상태/강수 형태는 가장 많이 나온 값, 같으면 먼저 나온 값
+# 기온/습도는 숫자가 아닌 값(CAST하면 0이 됨)을 빼고 평균
+# 강수량은 '1.5mm', '30.0~50.0mm' 등에서 앞의 숫자만 읽힘
+SUMMARY_SQL = """
+SELECT
+    (SELECT COUNT(*) FROM latest),
+    (SELECT AVG(CAST(value AS REAL)) FROM latest
+     WHERE category = 'T1H' AND value GLOB '*[0-9]*' AND value NOT GLOB '*[^0-9.+-]*'),
+    (SELECT AVG(CAST(value AS REAL)) FROM latest
+     WHERE category = 'REH' AND value GLOB '*[0-9]*' AND value NOT GLOB '*[^0-9.+-]*'),
+    (SELECT SUM(CASE WHEN value IN ('0', '강수없음') THEN 0
+                     WHEN value = '1mm 미만' THEN 0.5
+                     ELSE CAST(value AS REAL) END)
+     FROM latest WHERE category = 'RN1'),
+    (SELECT value FROM latest WHERE category = 'SKY'
+     GROUP BY value ORDER BY COUNT(*) DESC, MIN(fcst) LIMIT 1),
+    (SELECT value FROM latest WHERE category = 'PTY' AND value != '0'
+     GROUP BY value ORDER BY COUNT(*) DESC, MIN(fcst) LIMIT 1),
+    (SELECT group_concat(fcst) FROM (
+        SELECT DISTINCT fcst FROM latest
+        WHERE (category = 'PTY' AND value != '0') OR (category = 'RN1' AND value NOT IN ('0', '강수없음'))
+        ORDER BY fcst))
+"""
+
+class ForecastStore:
+    """초단기예보 항목을 (nx, ny, 발표 시각, 예보 시각, 항목)별로 쌓아 두는 SQLite 시계열 저장소
+
+    아직 저장하지 않은 발표분만 받아 오고, 요약은 예보 시각마다 가장 최근 발표 값을
+    골라 SQL로 집계한다. 같은 발표분을 동시에 요청하면 진행 중인 요청 하나를 함께 기다린다.
+    """
+    def __init__(self, path=None, keep_days=None):
+        self._path = path or FORECAST_DB_PATH
+        self._keep_days = keep_days or FORECAST_KEEP_DAYS
+        self._lock = threading.Lock()
+        self._conn = None
+        self._inflight = {}  # (nx, ny, 발표 시각) -> Future
+
+    def _db(self):
+        if self._conn is None:
+            if self._path != ":memory:":
+                os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS forecast (
+                    nx TEXT, ny TEXT, base TEXT, fcst TEXT, category TEXT, value TEXT,
+                    PRIMARY KEY (nx, ny, base, fcst, category)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS forecast_fcst ON forecast (nx, ny, fcst, category, base);
+                CREATE TABLE IF NOT EXISTS forecast_base (
+                    nx TEXT, ny TEXT, base TEXT, fetched_at REAL,
+                    PRIMARY KEY (nx, ny, base)
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    def has_base(self, nx, ny, base):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT 1 FROM forecast_base WHERE nx = ? AND ny = ? AND base = ?", (str(nx), str(ny), base)
+            ).fetchone()
+        return row is not None
+
+    def store(self, nx, ny, base, data):
+        """발표분 하나의 원본 응답을 저장하고 저장한 항목 수 반환 (item이 없으면 저장하지 않음)"""
+        items = forecast_items(data)
         if not items:
-            logger.error(f"API 응답에 item이 없습니다: {data}")
-            return None
+            raise RuntimeError(f"API 응답에 item이 없습니다: {data}")
+        rows = [
+            (str(nx), str(ny), base, item['fcstDate'] + item['fcstTime'], item['category'], str(item['fcstValue']))
+            for item in items
+        ]
+        cutoff = (datetime.now() - timedelta(days=self._keep_days)).strftime('%Y%m%d')
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO forecast VALUES (?, ?, ?, ?, ?, ?)", rows)
+                db.execute("INSERT OR REPLACE INTO forecast_base VALUES (?, ?, ?, ?)",
+                           (str(nx), str(ny), base, time.time()))
+                db.execute("DELETE FROM forecast WHERE base < ?", (cutoff,))
+                db.execute("DELETE FROM forecast_base WHERE base < ?", (cutoff,))
+        return len(rows)
 
-        today = now.strftime("%Y%m%d")
-        forecasts = {}
-        for item in items:
-            if item['fcstDate'] != today:
-                continue
-            fcst_time = item['fcstTime']
-            category = item['category']
-            value = item['fcstValue']
-            forecasts.setdefault(fcst_time, {})[category] = value
-
-        # 데이터 분석
-        temps, humidities, sky_codes, precip_types_list, precip_times = [], [], [], [], []
-        precip_sum = 0.0
-        for time_str in sorted(forecasts.keys()):
-            data = forecasts[time_str]
-            # 온도
-            if 'T1H' in data:
-                try: temps.append(float(data['T1H']))
-                except: pass
-            # 습도
-            if 'REH' in data:
-                try: humidities.append(float(data['REH']))
-                except: pass
-            # 하늘 상태
-            if 'SKY' in data:
-                sky_codes.append(data['SKY'])
-            # 강수 형태
-            pty = data.get('PTY', '0')
-            if pty != '0':
-                precip_type_map = {
-                    '0': '없음', '1': '비', '2': '비/눈', '3': '눈', '4': '소나기',
-                    '5': '빗방울', '6': '빗방울눈날림', '7': '눈날림'
-                }
-                precip_types_list.append(precip_type_map.get(pty, f'알 수 없음({pty})'))
-            # 강수량
-            rn1 = data.get('RN1', '0')
-            if rn1 not in ['0', '강수없음']:
-                try:
-                    if rn1 == '1mm 미만':
-                        precip_sum += 0.5
-                    elif 'mm' in rn1:
-                        precip_sum += float(re.search(r'(\d+\.?\d*)', rn1).group(1))
-                    else:
-                        precip_sum += float(rn1)
-                except: pass
-            # 강수 시간대
-            if pty != '0' or rn1 not in ['0', '강수없음']:
-                precip_times.append(f"{time_str[:2]}:{time_str[2:]}")
-
-        # 강수 시간대 그룹화
-        time_ranges = group_time_ranges(precip_times)
-        # 하늘 상태 결정
-        sky_condition = get_most_common_sky(sky_codes)
-        # 강수 형태 결정
-        precip_type = get_most_common_precip(precip_types_list)
-        # 최종 날씨 상태
-        weather_status = f"{sky_condition}{precip_type}"
+    def ensure(self, base_date, base_time, nx, ny):
+        """해당 발표분이 없을 때만 받아서 저장"""
+        base = base_date + base_time
+        key = (str(nx), str(ny), base)
+        if self.has_base(nx, ny, base):
+            count_cache("forecast", True)
+            return
+        count_cache("forecast", False)
+        with self._lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[key] = Future()
+        if not is_owner:
+            future.result()
+            return
+        try:
+            self.store(nx, ny, base, fetch_forecast(base_date, base_time, nx, ny))
+            future.set_result(True)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
 
+    def summary(self, nx, ny, date):
+        """date(datetime) 하루의 날씨 요약 (render_weather_image 입력, 저장된 항목이 없으면 None)"""
+        day = date.strftime("%Y%m%d")
+        params = (str(nx), str(ny), day, (date + timedelta(days=1)).strftime("%Y%m%d"))
+        with self._lock:
+            count, avg_temp, avg_humidity, precip_sum, sky, pty, precip_fcsts = self._db().execute(
+                LATEST_FORECAST_SQL + SUMMARY_SQL, params).fetchone()
+        if not count:
+            logger.error(f"{day} 예보 항목이 없습니다 (nx={nx}, ny={ny})")
+            return None
+
+        sky_condition = SKY_NAMES.get(sky, '알 수 없음') if sky else "정보 없음"
+        precip_type = f", {PTY_NAMES.get(pty, f'알 수 없음({pty})')}" if pty else ""
+        precip_times = [f"{fcst[8:10]}:{fcst[10:12]}" for fcst in precip_fcsts.split(",")] if precip_fcsts else []
         return {
-            'date': now.strftime("%m월 %d일"),
-            'avg_temp': sum(temps)/len(temps) if temps else None,
-            'avg_humidity': sum(humidities)/len(humidities) if humidities else None,
-            'weather_status': weather_status,
-            'precip_times': time_ranges,
-            'precip_sum': precip_sum
+            'date': date.strftime("%m월 %d일"),
+            'avg_temp': avg_temp,
+            'avg_humidity': avg_humidity,
+            'weather_status': f"{sky_condition}{precip_type}",
+            'precip_times': group_time_ranges(precip_times),
+            'precip_sum': precip_sum or 0.0,
         }
+
+forecast_store = ForecastStore()
+
+def get_weather_data(tenant=None, date=None):
+    """기상청 초단기예보를 가장 최근 발표분까지 저장소에 채우고 하루 날씨 요약 반환"""
+    tenant = tenant or DEFAULT_TENANT
+    now = datetime.now()
+    try:
+        base_date, base_time = get_forecast_base(now)
+        try:
+            forecast_store.ensure(base_date, base_time, tenant.nx, tenant.ny)
+        except Exception as e:
+            # 받아 두었던 이전 발표분이 있으면 그걸로 요약
+            logger.error(f"Weather fetch failed for base {base_date}{base_time}, using stored forecasts: {e}")
+        with span("parse.weather"):
+            return forecast_store.summary(tenant.nx, tenant.ny, date or now)
     except Exception as e:
         logger.error(f"Weather error: {e}", exc_info=True)
         return None
 
+SKY_NAMES = {'1': '맑음', '3': '구름많음', '4': '흐림'}
+PTY_NAMES = {
+    '0': '없음', '1': '비', '2': '비/눈', '3': '눈', '4': '소나기',
+    '5': '빗방울', '6': '빗방울눈날림', '7': '눈날림'
+}
+
 def group_time_ranges(times):
     """시간 리스트를 연속 구간으로 그룹화"""
     if not times:
@@ -185,35 +1012,23 @@ def group_time_ranges(times):
     time_ranges.append(f"{current_start}~{current_end}" if current_start != current_end else current_start)
     return time_ranges
 
-def get_most_common_sky(sky_codes):
-    """가장 많이 나온 하늘 상태 반환"""
-    if not sky_codes:
-        return "정보 없음"
-    sky_map = {'1': '맑음', '3': '구름많음', '4': '흐림'}
-    most_common = Counter(sky_codes).most_common(1)[0][0]
-    return sky_map.get(most_common, '알 수 없음')
-
-def get_most_common_precip(precip_types):
-    """가장 많이 나온 강수 형태 반환"""
-    if not precip_types:
-        return ""
-    most_common = Counter(precip_types).most_common(1)[0][0]
-    return f", {most_common}"
-
 # =========================
 # 이미지 생성 함수
 # =========================
 def create_weather_image(weather, output_path=None):
     """날씨 정보를 이미지로 생성"""
-    img = Image.new('RGB', (1080, 1920), (255, 255, 255))
-    draw = ImageDraw.Draw(img)
-    title_font, label_font, value_font, source_font = load_fonts()
+    img = render_weather_image(weather)
+    path = output_path or f"{IG_IMAGE_PATH}/{datetime.now().strftime('%Y%m%d')}_weather.jpg"
+    save_story_image(img, path)
+    logger.info(f"Weather image created: {path}")
+    return path
 
-    # 제목
-    title = f"{weather['date']} 날씨"
-    draw_centered_text(draw, title, 350, title_font)
-    # 출처
-    draw_centered_text(draw, "출처: 기상청 초단기예보", 430, source_font, color=(100,100,100))
+def render_weather_image(weather):
+    from PIL import ImageDraw
+    # 제목/출처는 날짜별로 한 번만 그려 둔 레이어를 복사해서 사용
+    img = weather_base_layer(weather['date']).copy()
+    draw = ImageDraw.Draw(img)
+    _, label_font, value_font, _ = load_fonts()
 
     # 날씨 정보 항목
     items = [
@@ -227,98 +1042,1109 @@ def create_weather_image(weather, output_path=None):
     for label, value in items:
         draw_label_value(draw, label, value, current_y, label_font, value_font)
         current_y += 100
+    return img
 
-    path = output_path or f"{IG_IMAGE_PATH}/{datetime.now().strftime('%Y%m%d')}_weather.jpg"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    img.save(path)
-    logger.info(f"Weather image created: {path}")
-    return path
-
-def create_menu_image(menu_text, meal_type, suffix):
-    """급식 메뉴 이미지를 생성"""
-    if menu_text is None:
-        return None
-    image = Image.new('RGB', (1080, 1920), (255, 255, 255))
+def render_menu_image(menu_text, meal_type):
+    from PIL import ImageDraw
+    image = blank_layer().copy()
     draw = ImageDraw.Draw(image)
-    font = load_font(FONT_PATH, 60)
     full_text = f"{meal_type}\n\n{menu_text}"
-    text_bbox = draw.textbbox((0, 0), full_text, font=font)
+    # 긴 메뉴도 캔버스를 넘지 않도록 글자 크기 자동 조정
+    font = fit_font(full_text, 1080 - 2 * STORY_MARGIN, 1920 - 2 * STORY_MARGIN)
+    text_bbox = measure_text(full_text, font)
     x = (1080 - (text_bbox[2] - text_bbox[0])) / 2
     y = (1920 - (text_bbox[3] - text_bbox[1])) / 2
     draw.text((x, y), full_text, fill=(0,0,0), font=font)
-    today = datetime.now().strftime('%Y%m%d')
-    image_path = f'{IG_IMAGE_PATH}/{today}{suffix}.jpg'
-    os.makedirs(os.path.dirname(image_path), exist_ok=True)
-    image.save(image_path)
-    logger.info(f"Menu image created: {image_path}")
-    return image_path
+    return image
+
+def save_story_image(image, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.lower().endswith((".jpg", ".jpeg")):
+        _write_bytes(path, encode_story(image))
+    else:
+        image.save(path)
+
+# =========================
+# 스토리 인코딩 (메모리 버퍼)
+# =========================
+# (품질, 크로마 서브샘플링) 후보: 글자가 선명한 4:4:4부터 시도하고 예산을 넘으면 4:2:0으로 낮춤
+JPEG_ENCODE_STEPS = [(95, 0), (90, 0), (85, 0), (85, 2), (80, 2), (75, 2), (70, 2), (60, 2), (50, 2)]
+
+def encode_story(image, max_bytes=None):
+    """스토리를 메모리에서 JPEG로 인코딩 (바이트 예산 안에서 가장 높은 품질)"""
+    max_bytes = max_bytes or STORY_MAX_BYTES
+    data = None
+    for quality, subsampling in JPEG_ENCODE_STEPS:
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=quality, subsampling=subsampling,
+                   progressive=True, optimize=True)
+        data = buf.getvalue()
+        if len(data) <= max_bytes:
+            break
+    else:
+        logger.warning(f"Story exceeds byte budget even at lowest quality: {len(data)} > {max_bytes}")
+    return data
+
+def build_story(render_func, args, archive_key=None):
+    """렌더링 -> 메모리 인코딩, STORY_ARCHIVE 설정 시에만 보관소에 저장
+
+    입력 지문이 같은 스토리는 다시 그리지 않고 렌더링 캐시에서 꺼내 씀
+    """
+    fingerprint = story_fingerprint(render_func, args)
+    data = fingerprint_store.load_rendered(fingerprint)
+    count_cache("render", data is not None)
+    if data is None:
+        with span("render", renderer=render_func.__name__):
+            image = render_func(*args)
+        with span("encode", renderer=render_func.__name__) as record:
+            data = encode_story(image)
+            record["bytes"] = len(data)
+        fingerprint_store.store_rendered(fingerprint, data)
+    else:
+        logger.info(f"Story render cache hit: {render_func.__name__} {fingerprint[:12]}")
+    data = Story(data, fingerprint)
+    archive_story(data, archive_key)
+    return data
+
+def archive_story(story, archive_key):
+    """STORY_ARCHIVE 설정 시 보관소에 저장 (색인 파일은 메인 프로세스에서만 갱신)"""
+    if not (STORY_ARCHIVE and archive_key and story):
+        return
+    try:
+        image_archive.put(*archive_key, story)
+    except Exception as e:
+        logger.error(f"Story archive failed: {e}")
+
+def story_key(kind, date=None, tenant=None):
+    """보관소 색인 키 (날짜, 종류) — 기본 학교가 아니면 종류 앞에 학교 이름을 붙임"""
+    date = date or datetime.now().strftime('%Y%m%d')
+    if tenant and tenant.name != DEFAULT_TENANT_NAME:
+        kind = f"{tenant.name}/{kind}"
+    return date, kind
+
+# =========================
+# 이미지 보관소 (내용 주소 저장)
+# =========================
+def image_dhash(data):
+    """급식 사진 지각 해시(dHash, 64비트): 재압축/크기 변경에도 거의 같은 값"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("L", (64, 64))
+        small = img.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+class ImageArchive:
+    """스토리와 급식 사진을 sha256 이름의 파일로 한 번만 저장하고 날짜별 색인으로 찾음
+
+    blobs/ab/abcd....jpg 에 내용을 두고 index.db(SQLite)에 blob(해시, 크기, dHash), 날짜/종류별 항목,
+    작업 파일(봇이 IG_IMAGE_PATH에 내려받은 파일, 이것만 정리 대상)을 기록한다. 같은 내용은 해시로,
+    같은 날 다시 올라온 급식 사진은 dHash 거리로 중복을 걸러낸다. 색인을 고칠 때는 쓰기 잠금을 잡으므로
+    데몬 옆에서 도는 --backfill/--pregenerate/--serve 프로세스와도 같은 보관소를 함께 쓸 수 있다.
+    """
+    def __init__(self, root=None, retention_days=None, max_bytes=None):
+        self.root = root or ARCHIVE_PATH
+        self.retention_days = retention_days or ARCHIVE_RETENTION_DAYS
+        self.max_bytes = max_bytes or ARCHIVE_MAX_BYTES
+        self._index_path = f"{self.root}/index.db"
+        self._lock = threading.Lock()
+        self._conn = None
+        self._compacted_on = None
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(self._index_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, dhash TEXT);
+                CREATE TABLE IF NOT EXISTS entries (
+                    day TEXT NOT NULL, kind TEXT NOT NULL, digest TEXT NOT NULL,
+                    PRIMARY KEY (day, kind)
+                );
+                CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+                CREATE TABLE IF NOT EXISTS workfiles (path TEXT PRIMARY KEY, day TEXT NOT NULL);
+            """)
+            self._conn = conn
+            self._migrate_json()
+        return self._conn
+
+    @contextmanager
+    def _write(self):
+        """다른 프로세스와 겹치지 않게 쓰기 잠금을 잡은 트랜잭션 (self._lock을 잡은 상태에서 사용)"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _migrate_json(self):
+        """이전 버전의 index.json 색인을 옮기고 index.json.bak으로 남김"""
+        json_path = f"{self.root}/index.json"
+        try:
+            with open(json_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"보관소 색인을 읽지 못했습니다: {e}")
+            return
+        with self._write() as db:
+            db.executemany("INSERT OR IGNORE INTO blobs (digest, size, dhash) VALUES (?, ?, ?)",
+                           [(d, b["size"], b.get("dhash")) for d, b in index.get("blobs", {}).items()])
+            db.executemany("INSERT OR IGNORE INTO entries (day, kind, digest) VALUES (?, ?, ?)",
+                           [(day, kind, d) for day, kinds in index.get("entries", {}).items() for kind, d in kinds.items()])
+            db.executemany("INSERT OR IGNORE INTO workfiles (path, day) VALUES (?, ?)",
+                           list(index.get("workfiles", {}).items()))
+        os.replace(json_path, f"{json_path}.bak")
+        logger.info("보관소 색인을 index.db로 옮겼습니다")
+
+    def blob_path(self, digest):
+        return f"{self.root}/blobs/{digest[:2]}/{digest}.jpg"
+
+    def _find_similar(self, db, date, kind, dhash):
+        """같은 날짜/종류에 이미 저장된 사진이 거의 같으면 그 해시 (급식판 사진은 날마다 비슷하므로 다른 날과는 비교하지 않음)"""
+        row = db.execute(
+            "SELECT b.digest, b.dhash FROM entries e JOIN blobs b ON b.digest = e.digest WHERE e.day = ? AND e.kind = ?",
+            (date, kind),
+        ).fetchone()
+        if row and row[1] is not None and bin(int(row[1], 16) ^ dhash).count("1") <= PHOTO_DHASH_DISTANCE:
+            return row[0]
+        return None
+
+    def put(self, date, kind, data, perceptual=False):
+        """내용을 저장하고 (날짜, 종류)에 연결한 뒤 blob 경로 반환"""
+        digest = hashlib.sha256(data).hexdigest()
+        dhash = image_dhash(data) if perceptual else None
+        today = datetime.now().strftime('%Y%m%d')
+        with self._lock, self._write() as db:
+            exists = db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if not exists and dhash is not None:
+                # 같은 사진을 다시 올린 경우(재압축 등)는 기존 사진을 재사용
+                similar = self._find_similar(db, date, kind, dhash)
+                if similar:
+                    digest, exists = similar, True
+            if not exists:
+                path = self.blob_path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                _write_bytes(tmp_path, data)
+                os.replace(tmp_path, path)
+                db.execute("INSERT INTO blobs (digest, size, dhash) VALUES (?, ?, ?)",
+                           (digest, len(data), f"{dhash:016x}" if dhash is not None else None))
+                logger.info(f"Archived {date}/{kind}: {digest[:12]} ({len(data)} bytes)")
+            else:
+                logger.info(f"Archived {date}/{kind}: {digest[:12]} (dedup)")
+            db.execute("INSERT OR REPLACE INTO entries (day, kind, digest) VALUES (?, ?, ?)", (date, kind, digest))
+            # 하루에 한 번 보관 정책 적용
+            if self._compacted_on != today:
+                self._compact(db, today)
+        return self.blob_path(digest)
+
+    def track_workfile(self, path, date=None):
+        """봇이 쓴 작업 파일로 등록 (WORKDIR_KEEP_DAYS가 지나면 정리)"""
+        path = os.path.abspath(path)
+        with self._lock, self._write() as db:
+            db.execute("INSERT OR IGNORE INTO workfiles (path, day) VALUES (?, ?)",
+                       (path, date or datetime.now().strftime('%Y%m%d')))
+
+    def path(self, date, kind):
+        """(날짜, 종류)에 저장된 blob 경로 (없으면 None)"""
+        with self._lock:
+            row = self._db().execute("SELECT digest FROM entries WHERE day = ? AND kind = ?", (date, kind)).fetchone()
+        return self.blob_path(row[0]) if row else None
+
+    def get(self, date, kind):
+        path = self.path(date, kind)
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def compact(self, today=None):
+        with self._lock, self._write() as db:
+            self._compact(db, today or datetime.now().strftime('%Y%m%d'))
+
+    def _compact(self, db, today):
+        """보관 기간/최대 크기를 넘는 오래된 날짜를 지우고 참조가 없어진 blob 삭제"""
+        self._compacted_on = today
+        cutoff = (datetime.strptime(today, '%Y%m%d') - timedelta(days=self.retention_days)).strftime('%Y%m%d')
+        db.execute("DELETE FROM entries WHERE day < ?", (cutoff,))
+
+        def live_bytes():
+            return db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM blobs WHERE digest IN (SELECT digest FROM entries)"
+            ).fetchone()[0]
+
+        total = live_bytes()
+        for (date,) in db.execute("SELECT DISTINCT day FROM entries ORDER BY day").fetchall():
+            if total <= self.max_bytes or date >= today:
+                break
+            db.execute("DELETE FROM entries WHERE day = ?", (date,))
+            total = live_bytes()
+
+        dead = [d for (d,) in db.execute("SELECT digest FROM blobs WHERE digest NOT IN (SELECT digest FROM entries)")]
+        db.executemany("DELETE FROM blobs WHERE digest = ?", [(d,) for d in dead])
+        live = {d for (d,) in db.execute("SELECT digest FROM blobs")}
+        # 색인에 없는 파일(색인에 넣기 전에 죽은 프로세스가 남긴 것 등)도 함께 정리
+        removed = 0
+        for dirpath, _, filenames in os.walk(f"{self.root}/blobs"):
+            for name in filenames:
+                if name.split(".", 1)[0] in live and name.endswith(".jpg"):
+                    continue
+                try:
+                    os.remove(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    pass
+                removed += 1
+        if removed:
+            logger.info(f"Archive compacted: {removed} blob(s) removed")
+        self._prune_workfiles(db, today)
+
+    def _prune_workfiles(self, db, today):
+        """등록된 작업 파일 중 오래된 것만 삭제 (보관은 보관소가 담당, 봇이 쓰지 않은 파일은 건드리지 않음)"""
+        cutoff = (datetime.strptime(today, '%Y%m%d') - timedelta(days=WORKDIR_KEEP_DAYS)).strftime('%Y%m%d')
+        for (path,) in db.execute("SELECT path FROM workfiles WHERE day < ?", (cutoff,)).fetchall():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        db.execute("DELETE FROM workfiles WHERE day < ?", (cutoff,))
+
+image_archive = ImageArchive()
+
+# =========================
+# 입력 지문 (중복 렌더링/업로드 방지)
+# =========================
+class Story(bytes):
+    """인코딩된 스토리 JPEG 바이트 + 입력 지문"""
+    def __new__(cls, data, fingerprint=None):
+        story = super().__new__(cls, data)
+        story.fingerprint = fingerprint
+        return story
+
+    def __reduce__(self):
+        # 프로세스 풀에서 돌려받을 때도 지문 유지
+        return Story, (bytes(self), self.fingerprint)
+
+def normalize_input(value):
+    """지문 계산용 입력 정규화: 공백 정리, dict 키 정렬, 사진은 파일 내용 해시"""
+    if isinstance(value, str):
+        if value.lower().endswith((".jpg", ".jpeg", ".png")) and os.path.isfile(value):
+            with open(value, "rb") as f:
+                return {"photo": hashlib.sha256(f.read()).hexdigest()}
+        return "\n".join(" ".join(line.split()) for line in value.strip().splitlines())
+    if isinstance(value, dict):
+        return {str(k): normalize_input(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(v) for v in value]
+    if isinstance(value, float):
+        return round(value, 3)
+    return value
+
+def story_fingerprint(render_func, args):
+    payload = [TEMPLATE_VERSION, render_func.__name__, normalize_input(args)]
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def pid_alive(pid):
+    """같은 호스트(컨테이너)에서 pid 프로세스가 살아 있는지"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def process_start(pid):
+    """pid 프로세스의 시작 시각(부팅 후 클럭 틱, /proc/<pid>/stat 22번째 값), 알 수 없으면 None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # 2번째 값(실행 파일 이름)에 공백이 있을 수 있으므로 마지막 ')' 뒤에서부터 센다
+    fields = stat[stat.rfind(")") + 2:].split()
+    return fields[19] if len(fields) > 19 else None
+
+_process_tokens = {}
+
+def process_token():
+    """업로드 기록/대기열의 owner 값 "pid:시작시각"
+
+    도커에서는 데몬이 항상 pid 1이라 pid만으로는 재시작 전 프로세스와 구분되지 않는다.
+    """
+    pid = os.getpid()
+    token = _process_tokens.get(pid)
+    if token is None:
+        token = _process_tokens[pid] = f"{pid}:{process_start(pid) or os.urandom(8).hex()}"
+    return token
+
+def owner_alive(owner):
+    """owner 값(process_token(), 이전 버전은 pid 숫자)의 프로세스가 아직 살아 있는지"""
+    if not owner:
+        return False
+    pid, _, start = str(owner).partition(":")
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        # 같은 pid를 받은 이전 실행(재시작 전 데몬)의 값이면 이미 죽은 프로세스
+        return str(owner) == process_token()
+    if not pid_alive(pid):
+        return False
+    current = process_start(pid)
+    # 시작 시각을 읽을 수 없으면 같은 pid를 다시 받은 다른 프로세스인지 알 수 없으므로 살아 있다고 본다
+    return not start or current is None or current == start
+
+class FingerprintStore:
+    """입력 지문별 렌더링 결과와 날짜별 업로드 기록((지문, 계정))을 보관
+
+    렌더링 결과는 지문 이름의 파일이라 렌더링 프로세스에서도 안전하게 읽고 쓸 수 있다.
+    업로드 기록은 SQLite 표라서 데몬과 --uploadnow처럼 동시에 도는 프로세스끼리도 공유되고,
+    올리기 전에 reserve()로 먼저 자리를 잡은 프로세스만 업로드한다.
+    """
+    def __init__(self, path=None, render_dir=None, keep_days=None):
+        self._path = path or FINGERPRINT_PATH
+        self._render_dir = render_dir or RENDER_CACHE_PATH
+        self._keep_days = keep_days or FINGERPRINT_KEEP_DAYS
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pruned = None  # 마지막으로 정리한 날짜
+        self._uploading = set()  # 이 프로세스의 스레드가 올리는 중인 (날짜, 지문, 계정)
+
+    def _render_path(self, fingerprint):
+        return f"{self._render_dir}/{fingerprint}.jpg"
+
+    def load_rendered(self, fingerprint):
+        path = self._render_path(fingerprint)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # hold_rendered()로 게시일까지 미뤄 둔 수정 시각은 그대로 둠
+            if os.stat(path).st_mtime < time.time():
+                os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store_rendered(self, fingerprint, data):
+        path = self._render_path(fingerprint)
+        try:
+            os.makedirs(self._render_dir, exist_ok=True)
+            # 같은 지문을 여러 스레드/프로세스가 동시에 렌더링할 수 있으므로 임시 파일 이름은 겹치지 않게
+            with tempfile.NamedTemporaryFile(suffix=".tmp", dir=self._render_dir, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.warning(f"렌더링 캐시 저장 실패: {e}")
+
+    def hold_rendered(self, fingerprint, date):
+        """미리 만든 렌더링 결과가 게시일(YYYYMMDD) 전에 정리되지 않도록 수정 시각을 그날로 맞춤"""
+        path = self._render_path(fingerprint)
+        ts = datetime.strptime(date, '%Y%m%d').timestamp()
+        try:
+            if os.stat(path).st_mtime < ts:
+                os.utime(path, (ts, ts))
+        except OSError as e:
+            logger.warning(f"렌더링 캐시 보존 설정 실패: {e}")
+
+    def _db(self):
+        if self._conn is None:
+            if self._path != ":memory:":
+                os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS posted (
+                    day TEXT NOT NULL, fingerprint TEXT NOT NULL, account TEXT NOT NULL,
+                    owner TEXT, posted_at REAL,
+                    PRIMARY KEY (day, fingerprint, account)
+                );
+            """)
+            self._conn = conn
+        return self._conn
+
+    def was_posted(self, fingerprint, account, date=None):
+        """오늘 이미 올렸거나 살아 있는 다른 프로세스가 올리는 중이면 True"""
+        date = date or datetime.now().strftime('%Y%m%d')
+        with self._lock:
+            row = self._db().execute(
+                "SELECT owner, posted_at FROM posted WHERE day = ? AND fingerprint = ? AND account = ?",
+                (date, fingerprint, account),
+            ).fetchone()
+            if row is None:
+                return False
+            owner, posted_at = row
+            if owner == process_token():
+                return posted_at is not None or (date, fingerprint, account) in self._uploading
+        return posted_at is not None or owner_alive(owner)
+
+    def reserve(self, fingerprint, account, date=None):
+        """업로드 직전에 자리를 잡음, 이 프로세스가 올려야 하면 True
+
+        이미 올렸거나 다른 프로세스(또는 이 프로세스의 다른 스레드)가 올리는 중이면 False.
+        올리다 죽은 프로세스의 자리는 pid가 같은 재시작 후 프로세스라도 넘겨받는다.
+        """
+        date = date or datetime.now().strftime('%Y%m%d')
+        token, key = process_token(), (date, fingerprint, account)
+        with self._lock:
+            db = self._db()
+            if self._pruned != date:
+                self._prune(date)
+            with db:
+                if db.execute(
+                    "INSERT OR IGNORE INTO posted (day, fingerprint, account, owner) VALUES (?, ?, ?, ?)",
+                    (date, fingerprint, account, token),
+                ).rowcount:
+                    self._uploading.add(key)
+                    return True
+                owner, posted_at = db.execute(
+                    "SELECT owner, posted_at FROM posted WHERE day = ? AND fingerprint = ? AND account = ?",
+                    (date, fingerprint, account),
+                ).fetchone()
+                if posted_at is not None or key in self._uploading:
+                    return False
+                if owner != token and owner_alive(owner):
+                    return False
+                if not db.execute(
+                    "UPDATE posted SET owner = ? WHERE day = ? AND fingerprint = ? AND account = ? "
+                    "AND owner IS ? AND posted_at IS NULL",
+                    (token, date, fingerprint, account, owner),
+                ).rowcount:
+                    return False
+                self._uploading.add(key)
+                return True
+
+    def release(self, fingerprint, account, date=None):
+        """업로드에 실패했을 때 잡아 둔 자리를 돌려줌"""
+        date = date or datetime.now().strftime('%Y%m%d')
+        with self._lock:
+            self._uploading.discard((date, fingerprint, account))
+            db = self._db()
+            with db:
+                db.execute(
+                    "DELETE FROM posted WHERE day = ? AND fingerprint = ? AND account = ? "
+                    "AND owner = ? AND posted_at IS NULL",
+                    (date, fingerprint, account, process_token()),
+                )
+
+    def mark_posted(self, fingerprint, account, date=None):
+        date = date or datetime.now().strftime('%Y%m%d')
+        with self._lock:
+            self._uploading.discard((date, fingerprint, account))
+            db = self._db()
+            with db:
+                db.execute(
+                    "INSERT INTO posted (day, fingerprint, account, owner, posted_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (day, fingerprint, account) DO UPDATE SET posted_at = excluded.posted_at",
+                    (date, fingerprint, account, process_token(), time.time()),
+                )
+
+    def _prune(self, today):
+        """하루에 한 번 오래된 업로드 기록과 한동안 쓰지 않은 렌더링 결과 삭제"""
+        self._pruned = today
+        cutoff = datetime.strptime(today, '%Y%m%d') - timedelta(days=self._keep_days)
+        with self._db() as db:
+            db.execute("DELETE FROM posted WHERE day < ?", (cutoff.strftime('%Y%m%d'),))
+        try:
+            entries = list(os.scandir(self._render_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+fingerprint_store = FingerprintStore()
 
 def load_fonts():
     """여러 크기의 폰트 로드"""
-    try:
-        return (
-            ImageFont.truetype(FONT_PATH, 60),
-            ImageFont.truetype(FONT_PATH, 50),
-            ImageFont.truetype(FONT_PATH, 48),
-            ImageFont.truetype(FONT_PATH, 38),
-        )
-    except:
-        return (
-            ImageFont.load_default(),
-            ImageFont.load_default(),
-            ImageFont.load_default(),
-            ImageFont.load_default(),
-        )
+    return tuple(load_font(FONT_PATH, size) for size in (60, 50, 48, 38))
 
+@lru_cache(maxsize=None)
 def load_font(path, size):
+    """(경로, 크기)별로 한 번만 읽어 프로세스 전체에서 재사용"""
+    from PIL import ImageFont
     try:
         return ImageFont.truetype(path, size)
     except:
         return ImageFont.load_default()
 
+_measure_draw = None
+
+@lru_cache(maxsize=4096)
+def measure_text(text, font):
+    """텍스트 bbox 계산 결과 캐시 (폰트 객체는 load_font 캐시로 고정됨)"""
+    global _measure_draw
+    if _measure_draw is None:
+        from PIL import Image, ImageDraw
+        _measure_draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    return _measure_draw.textbbox((0, 0), text, font=font)
+
+def fit_font(text, max_width, max_height, max_size=60, min_size=28, path=FONT_PATH):
+    """영역 안에 들어가는 가장 큰 폰트를 이진 탐색으로 선택"""
+    lo, hi = min_size, max_size
+    best = min_size
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        bbox = measure_text(text, load_font(path, mid))
+        if bbox[2] - bbox[0] <= max_width and bbox[3] - bbox[1] <= max_height:
+            best = mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return load_font(path, best)
+
 def draw_centered_text(draw, text, y, font, color=(0,0,0)):
-    bbox = draw.textbbox((0,0), text, font=font)
+    bbox = measure_text(text, font)
     width = bbox[2] - bbox[0]
     draw.text(((1080-width)/2, y), text, color, font=font)
 
 def draw_label_value(draw, label, value, y, label_font, value_font):
     text = f"{label}: {value}"
-    bbox = draw.textbbox((0,0), text, font=label_font)
+    bbox = measure_text(text, label_font)
     width = bbox[2] - bbox[0]
     if width > 900:
         # 두 줄로 나누기
-        label_bbox = draw.textbbox((0,0), label+":", font=label_font)
+        label_bbox = measure_text(label+":", label_font)
         label_width = label_bbox[2] - label_bbox[0]
         draw.text(((1080-label_width)/2, y), label+":", (0,0,0), font=label_font)
         y += 70
-        value_bbox = draw.textbbox((0,0), value, font=value_font)
+        value_bbox = measure_text(value, value_font)
         value_width = value_bbox[2] - value_bbox[0]
         draw.text(((1080-value_width)/2, y), value, (0,0,0), font=value_font)
     else:
         draw.text(((1080-width)/2, y), text, (0,0,0), font=label_font)
 
+# =========================
+# 정적 레이어 템플릿 및 일괄 렌더링
+# =========================
+@lru_cache(maxsize=1)
+def blank_layer():
+    """흰 배경 스토리 캔버스 (복사해서 사용)"""
+    from PIL import Image
+    return Image.new('RGB', (1080, 1920), (255, 255, 255))
+
+@lru_cache(maxsize=4)
+def weather_base_layer(date_text):
+    """날씨 스토리의 고정 부분(제목, 출처)을 날짜별로 한 번만 렌더링"""
+    from PIL import ImageDraw
+    img = blank_layer().copy()
+    draw = ImageDraw.Draw(img)
+    title_font, _, _, source_font = load_fonts()
+    # 제목
+    draw_centered_text(draw, f"{date_text} 날씨", 350, title_font)
+    # 출처
+    draw_centered_text(draw, "출처: 기상청 초단기예보", 430, source_font, color=(100,100,100))
+    return img
+
+# 렌더링 프로세스에 넘겨줄 설정 (하네스/벤치가 바꾼 값도 그대로 쓰도록)
+RENDER_WORKER_SETTINGS = ("FONT_PATH", "STORY_MAX_BYTES", "TEMPLATE_VERSION", "METRICS_PATH", "METRICS_MAX_BYTES")
+
+_render_pool = None
+_render_pool_workers = 0
+_render_pool_lock = threading.Lock()
+
+def _init_render_worker(cwd, settings):
+    os.chdir(cwd)
+    globals().update(settings)
+
+def get_render_pool(max_workers=None):
+    """프로세스 풀을 한 번만 만들어 재사용
+
+    데몬에는 업로드/감시/서버 스레드가 돌고 있어서 fork하면 다른 스레드가 잡고 있던 락(_trace_lock,
+    metrics 락 등)이 자식에서 영원히 풀리지 않을 수 있으므로, 스레드가 없는 forkserver(없으면 spawn)로 만든다.
+    """
+    global _render_pool, _render_pool_workers
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    workers = max_workers or RENDER_WORKERS or os.cpu_count() or 1
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_workers != workers:
+            if _render_pool is not None:
+                _render_pool.shutdown(wait=False)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            settings = {name: globals()[name] for name in RENDER_WORKER_SETTINGS}
+            _render_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(method),
+                initializer=_init_render_worker, initargs=(os.getcwd(), settings),
+            )
+            _render_pool_workers = workers
+        return _render_pool
+
+def reset_render_pool():
+    """멈췄거나 깨진 풀을 버림 (다음 렌더링 때 새로 만듦)"""
+    global _render_pool
+    with _render_pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def render_stories(specs, max_workers=None):
+    """(함수, 인자) 목록을 프로세스 풀에서 동시에 렌더링하고 결과를 같은 순서로 반환
+
+    RENDER_TIMEOUT 안에 끝나지 않거나 풀이 깨지면 풀을 버리고 이 프로세스에서 차례로 렌더링한다.
+    """
+    specs = list(specs)
+    workers = min(len(specs), max_workers or RENDER_WORKERS or os.cpu_count() or 1)
+    if workers < 2:
+        return [func(*args) for func, args in specs]
+    # 자식 프로세스의 span은 파일에만 남으므로 작업 요약에는 묶음 단위로 기록
+    with span("render.batch", stories=len(specs), workers=workers):
+        try:
+            pool = get_render_pool(max_workers)
+            futures = [pool.submit(func, *args) for func, args in specs]
+            deadline = time.monotonic() + RENDER_TIMEOUT
+            return [future.result(timeout=max(0, deadline - time.monotonic())) for future in futures]
+        except Exception as e:
+            logger.error(f"Render pool failed, 이 프로세스에서 직접 렌더링합니다: {e!r}")
+            metrics.inc("lunchbot_render_pool_fallback_total")
+            reset_render_pool()
+    return [func(*args) for func, args in specs]
+
+def render_daily_stories(lunch_menu=None, dinner_menu=None, weather_data=None, tenant=None, date=None):
+    """하루치 텍스트 스토리(중식/석식/날씨)를 한 번에 렌더링해 {종류: JPEG 바이트} 반환"""
+    specs = {}
+    if lunch_menu:
+        specs["lunch"] = (build_story, (render_menu_image, (lunch_menu, "중식")))
+    if dinner_menu:
+        specs["dinner"] = (build_story, (render_menu_image, (dinner_menu, "석식")))
+    if weather_data:
+        specs["weather"] = (build_story, (render_weather_image, (weather_data,)))
+    stories = dict(zip(specs.keys(), render_stories(specs.values())))
+    # 렌더링 프로세스끼리 보관소 색인을 덮어쓰지 않도록 보관은 여기서
+    for kind, story in stories.items():
+        archive_story(story, story_key(kind, date, tenant))
+    return stories
+
 # =========================
 # 급식 메뉴 관련 함수
 # =========================
-def get_meal_menu(meal_code):
-    """오늘의 급식 메뉴를 가져옴 (2: 중식, 3: 석식)"""
-    today = datetime.now().strftime('%Y%m%d')
-    url = (
-        f'https://open.neis.go.kr/hub/mealServiceDietInfo?Type=json&pSize=100'
-        f'&ATPT_OFCDC_SC_CODE=B10&SD_SCHUL_CODE=7010208&MMEAL_SC_CODE={meal_code}&MLSV_YMD={today}'
+DISH_PAREN_RE = re.compile(r'\s*\(([^)]*)\)')
+DISH_MARKER_RE = re.compile(r'(?<=[가-힣])y+$')  # 일부 학교가 메뉴 이름 끝에 붙이는 표시
+ALLERGEN_GROUP_RE = re.compile(r'[\d.\s]+')
+
+class Dish:
+    """메뉴 한 줄: 이름과 알레르기 유발 식품 번호 (1: 난류 ... 19: 잣)"""
+    __slots__ = ("name", "allergens")
+
+    def __init__(self, name, allergens=()):
+        self.name = name
+        self.allergens = frozenset(allergens)
+
+    def __repr__(self):
+        return f"Dish({self.name!r}, {sorted(self.allergens)})"
+
+    @classmethod
+    def parse(cls, item):
+        """'짜장면y (5.6.10.13)' -> Dish('짜장면', {5, 6, 10, 13})"""
+        allergens = []
+        if '(' in item:
+            for group in DISH_PAREN_RE.findall(item):
+                # 괄호 안이 숫자와 점뿐이면 알레르기 번호, 그 밖의 괄호 내용은 버림
+                if ALLERGEN_GROUP_RE.fullmatch(group):
+                    allergens.extend(int(code) for code in group.split('.') if code.strip())
+            item = DISH_PAREN_RE.sub('', item)
+        name = item.strip()
+        if name.endswith('y'):
+            name = DISH_MARKER_RE.sub('', name)
+        return cls(name, allergens)
+
+class Meal:
+    """하루 한 끼: 날짜, 끼니, 메뉴 목록과 열량/영양/원산지 정보"""
+    __slots__ = ("date", "meal_code", "meal_name", "dishes", "calories", "nutrition", "origin")
+
+    def __init__(self, date, meal_code, meal_name, dishes, calories=None, nutrition=None, origin=None):
+        self.date = date
+        self.meal_code = meal_code
+        self.meal_name = meal_name
+        self.dishes = tuple(dishes)
+        self.calories = calories
+        self.nutrition = nutrition or {}
+        self.origin = origin or {}
+
+    @classmethod
+    def from_row(cls, row):
+        """NEIS mealServiceDietInfo 행에서 생성"""
+        calories = re.match(r'\s*([\d.]+)', row.get('CAL_INFO') or '')
+        return cls(
+            row['MLSV_YMD'], int(row['MMEAL_SC_CODE']), row.get('MMEAL_SC_NM'),
+            parse_dishes(row.get('DDISH_NM') or ''),
+            float(calories.group(1)) if calories else None,
+            {k: float(v) for k, v in parse_info_pairs(row.get('NTR_INFO')).items() if re.fullmatch(r'[\d.]+', v)},
+            parse_info_pairs(row.get('ORPLC_INFO')),
+        )
+
+    @property
+    def menu_text(self):
+        return '\n'.join(dish.name for dish in self.dishes)
+
+    @property
+    def allergens(self):
+        return frozenset().union(*(dish.allergens for dish in self.dishes))
+
+def parse_dishes(ddish_nm):
+    return [Dish.parse(item) for item in ddish_nm.split('<br/>') if item.strip()]
+
+def parse_info_pairs(text):
+    """'탄수화물(g) : 120.5<br/>단백질(g) : 35.2' -> {'탄수화물(g)': '120.5', '단백질(g)': '35.2'}"""
+    pairs = {}
+    for item in (text or '').split('<br/>'):
+        key, sep, value = item.rpartition(' : ')
+        if sep:
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+def clean_menu_text(ddish_nm):
+    """NEIS DDISH_NM 값을 줄 단위 메뉴 문자열로 정리"""
+    return '\n'.join(dish.name for dish in parse_dishes(ddish_nm))
+
+def fetch_meal_rows(from_ymd, to_ymd, office_code=NEIS_OFFICE_CODE, school_code=NEIS_SCHOOL_CODE):
+    """기간 내 모든 끼니(조식/중식/석식)의 식단 행을 페이지 단위로 한 번에 가져옴"""
+    rows = []
+    page = 1
+    with span("fetch.meal", school=school_code, month=from_ymd[:6]) as record:
+        while True:
+            response = http_transport.get(neis_meal_url(from_ymd, to_ymd, page, office_code, school_code))
+            response.raise_for_status()
+            page_rows, total = parse_meal_page(response.json())
+            rows.extend(page_rows)
+            if not page_rows or len(rows) >= total:
+                break
+            page += 1
+        record["rows"] = len(rows)
+    return rows
+
+def neis_meal_url(from_ymd, to_ymd, page, office_code=NEIS_OFFICE_CODE, school_code=NEIS_SCHOOL_CODE):
+    return (
+        f'https://open.neis.go.kr/hub/mealServiceDietInfo?Type=json&pIndex={page}&pSize={NEIS_PAGE_SIZE}'
+        f'&ATPT_OFCDC_SC_CODE={office_code}&SD_SCHUL_CODE={school_code}'
+        f'&MLSV_FROM_YMD={from_ymd}&MLSV_TO_YMD={to_ymd}'
     )
+
+def parse_meal_page(data):
+    """mealServiceDietInfo 응답 한 페이지에서 (행 목록, 전체 건수) 추출"""
+    if 'mealServiceDietInfo' not in data:
+        result = data.get('RESULT', {})
+        # INFO-200: 해당하는 데이터 없음 (방학 등)
+        if result.get('CODE') == 'INFO-200':
+            return [], 0
+        raise RuntimeError(f"NEIS 응답 오류: {result}")
+    head, body = data['mealServiceDietInfo']
+    total = head['head'][0]['list_total_count']
+    return body.get('row', []), total
+
+def month_range(month):
+    """YYYYMM -> (해당 월 첫날, 마지막 날) YYYYMMDD"""
+    year, mon = int(month[:4]), int(month[4:])
+    last_day = calendar.monthrange(year, mon)[1]
+    return f"{month}01", f"{month}{last_day:02d}"
+
+class MealRepository:
+    """월 단위로 NEIS 식단을 받아 (날짜, 끼니)별로 디스크에 캐시하는 저장소"""
+    def __init__(self, office_code=NEIS_OFFICE_CODE, school_code=NEIS_SCHOOL_CODE, cache_path=None, ttl=MEAL_CACHE_TTL):
+        self.office_code = office_code
+        self.school_code = school_code
+        self._cache_path = cache_path or f"{CACHE_PATH}/meals_{office_code}_{school_code}.json"
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._fetch_locks = {}  # month -> Lock (같은 달을 동시에 두 번 받지 않도록)
+        self._refreshing = set()
+        self._miss_checked = {}  # month -> 캐시에 없는 날짜 때문에 마지막으로 다시 받아 본 시각
+        # {"YYYYMM": {"fetched_at": ts, "rows": {"YYYYMMDD:코드": row}}}
+        self._months = self._load()
+
+    def _load(self):
+        try:
+            with open(self._cache_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"급식 캐시를 읽지 못했습니다: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+        tmp_path = f"{self._cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._months, f, ensure_ascii=False)
+        os.replace(tmp_path, self._cache_path)
+
+    def refresh_month(self, month):
+        """한 달치 식단을 다시 받아 캐시 갱신 (month: YYYYMM)"""
+        with self._month_lock(month):
+            rows = fetch_meal_rows(*month_range(month), self.office_code, self.school_code)
+            self.store_month(month, rows)
+
+    def _month_lock(self, month):
+        with self._lock:
+            return self._fetch_locks.setdefault(month, threading.Lock())
+
+    @property
+    def school_key(self):
+        return f"{self.office_code}_{self.school_code}"
+
+    def store_month(self, month, rows):
+        """받아 온 한 달치 식단 행을 캐시와 식단 기록 색인에 저장"""
+        entry = {
+            "fetched_at": time.time(),
+            "rows": {
+                f"{row['MLSV_YMD']}:{row['MMEAL_SC_CODE']}": {k: row.get(k) for k in MEAL_ROW_FIELDS}
+                for row in rows
+            },
+        }
+        with self._lock:
+            self._months[month] = entry
+            self._save()
+        logger.info(f"Meal cache refreshed for {month}: {len(rows)} rows")
+        try:
+            meal_history.store(self.school_key, [Meal.from_row(row) for row in entry["rows"].values()])
+        except Exception as e:
+            logger.warning(f"식단 기록 색인 실패 ({month}): {e}")
+
+    def sync_history(self):
+        """색인에 아직 없는 캐시된 달을 식단 기록에 넣음 (NEIS 요청 없음)"""
+        indexed = meal_history.months(self.school_key)
+        with self._lock:
+            pending = {month: list(entry["rows"].values()) for month, entry in self._months.items()
+                       if month not in indexed}
+        for month, rows in pending.items():
+            meal_history.store(self.school_key, [Meal.from_row(row) for row in rows])
+
+    def _refresh_in_background(self, month):
+        with self._lock:
+            if month in self._refreshing:
+                return
+            self._refreshing.add(month)
+
+        def run():
+            try:
+                self.refresh_month(month)
+            except Exception as e:
+                logger.warning(f"급식 캐시 백그라운드 갱신 실패 ({month}): {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(month)
+
+        threading.Thread(target=run, name=f"meal-refresh-{month}", daemon=True).start()
+
+    def is_fresh(self, month):
+        with self._lock:
+            entry = self._months.get(month)
+        return entry is not None and time.time() - entry["fetched_at"] <= self._ttl
+
+    def get_row(self, ymd, meal_code):
+        """캐시된 식단 행 반환, 오래된 캐시는 그대로 쓰고 백그라운드에서 갱신
+
+        캐시한 뒤에 NEIS에 올라온 식단을 놓치지 않도록, 오늘 근처 날짜가 캐시에 없으면
+        (MEAL_MISS_REFRESH초에 한 번까지) 그 자리에서 다시 받아 확인한다.
+        """
+        month = ymd[:6]
+        with self._lock:
+            entry = self._months.get(month)
+        count_cache("meal", entry is not None)
+        if entry is None:
+            with self._month_lock(month):
+                # 다른 스레드가 먼저 받아 왔으면 그 결과 사용
+                with self._lock:
+                    entry = self._months.get(month)
+                if entry is None:
+                    rows = fetch_meal_rows(*month_range(month), self.office_code, self.school_code)
+                    self.store_month(month, rows)
+                    with self._lock:
+                        entry = self._months[month]
+        elif f"{ymd}:{meal_code}" not in entry["rows"] and self._near_today(ymd):
+            entry = self._refresh_missing(month, entry)
+        elif time.time() - entry["fetched_at"] > self._ttl:
+            self._refresh_in_background(month)
+        return entry["rows"].get(f"{ymd}:{meal_code}")
+
+    @staticmethod
+    def _near_today(ymd):
+        days = (datetime.strptime(ymd, '%Y%m%d') - datetime.now()).days
+        return -MEAL_MISS_WINDOW_DAYS <= days <= MEAL_MISS_WINDOW_DAYS
+
+    def _refresh_missing(self, month, entry):
+        """마지막으로 받은 지 MEAL_MISS_REFRESH초가 지났으면 다시 받아 새 항목 반환 (실패하면 기존 캐시)"""
+        with self._month_lock(month):
+            with self._lock:
+                entry = self._months.get(month, entry)
+                last_checked = max(entry["fetched_at"], self._miss_checked.get(month, 0))
+                if time.time() - last_checked < MEAL_MISS_REFRESH:
+                    return entry
+                self._miss_checked[month] = time.time()
+            try:
+                rows = fetch_meal_rows(*month_range(month), self.office_code, self.school_code)
+            except Exception as e:
+                logger.warning(f"급식 캐시에 없는 날짜 확인 실패 ({month}), 캐시 사용: {e}")
+                return entry
+            self.store_month(month, rows)
+            with self._lock:
+                return self._months[month]
+
+    def get_meal(self, ymd, meal_code):
+        row = self.get_row(ymd, meal_code)
+        return Meal.from_row(row) if row else None
+
+    def get_menu(self, ymd, meal_code):
+        meal = self.get_meal(ymd, meal_code)
+        return meal.menu_text if meal else None
+
+class MealHistory:
+    """학교별 지난 식단을 끼니/메뉴 단위로 쌓아 두는 SQLite 색인
+
+    메뉴 이름은 FTS5 trigram 색인으로 부분 검색하고(세 글자 미만이나 FTS5가 없으면 LIKE),
+    알레르기 번호는 비트 마스크로 저장해 NEIS에 다시 묻지 않고 바로 찾는다.
+    """
+    def __init__(self, path=None):
+        self._path = path or MEAL_HISTORY_PATH
+        self._lock = threading.Lock()
+        self._conn = None
+        self._fts = True
+
+    def _db(self):
+        if self._conn is None:
+            if self._path != ":memory:":
+                os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meal (
+                    school TEXT, date TEXT, meal_code INTEGER, meal_name TEXT,
+                    calories REAL, nutrition TEXT, origin TEXT,
+                    PRIMARY KEY (school, date, meal_code)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS dish (
+                    id INTEGER PRIMARY KEY, school TEXT, date TEXT, meal_code INTEGER,
+                    pos INTEGER, name TEXT, allergen_mask INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS dish_day ON dish (school, date, meal_code);
+            """)
+            try:
+                conn.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS dish_fts USING fts5(
+                        name, content='dish', content_rowid='id', tokenize='trigram');
+                    CREATE TRIGGER IF NOT EXISTS dish_ai AFTER INSERT ON dish BEGIN
+                        INSERT INTO dish_fts (rowid, name) VALUES (new.id, new.name);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS dish_ad AFTER DELETE ON dish BEGIN
+                        INSERT INTO dish_fts (dish_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                    END;
+                """)
+            except sqlite3.OperationalError as e:
+                # SQLite가 FTS5/trigram 없이 빌드된 경우 LIKE 검색으로 대신함
+                logger.warning(f"FTS5 trigram 색인을 만들 수 없어 LIKE 검색을 사용합니다: {e}")
+                self._fts = False
+            self._conn = conn
+        return self._conn
+
+    def store(self, school, meals):
+        """끼니 목록을 저장 (같은 날짜/끼니는 새 내용으로 교체)"""
+        meal_rows, dish_rows = [], []
+        for meal in meals:
+            meal_rows.append((school, meal.date, meal.meal_code, meal.meal_name, meal.calories,
+                              json.dumps(meal.nutrition, ensure_ascii=False), json.dumps(meal.origin, ensure_ascii=False)))
+            for pos, dish in enumerate(meal.dishes):
+                mask = sum(1 << code for code in dish.allergens if 0 < code < 63)
+                dish_rows.append((school, meal.date, meal.meal_code, pos, dish.name, mask))
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("DELETE FROM dish WHERE school = ? AND date = ? AND meal_code = ?",
+                               [row[:3] for row in meal_rows])
+                db.executemany("INSERT OR REPLACE INTO meal VALUES (?, ?, ?, ?, ?, ?, ?)", meal_rows)
+                db.executemany("INSERT INTO dish (school, date, meal_code, pos, name, allergen_mask) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", dish_rows)
+        return len(meal_rows)
+
+    def months(self, school):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT DISTINCT substr(date, 1, 6) FROM meal WHERE school = ?", (school,)).fetchall()
+        return {row[0] for row in rows}
+
+    def search(self, school, text, limit=10):
+        """메뉴 이름에 text가 들어간 최근 끼니 [(날짜, 끼니 이름, 메뉴 이름)] (최신순)"""
+        text = text.strip()
+        sql = ("SELECT d.date, m.meal_name, d.name FROM dish d "
+               "JOIN meal m ON m.school = d.school AND m.date = d.date AND m.meal_code = d.meal_code ")
+        with self._lock:
+            db = self._db()
+            if self._fts and len(text) >= 3:
+                sql += "WHERE d.id IN (SELECT rowid FROM dish_fts WHERE dish_fts MATCH ?) AND d.school = ? "
+                params = ('"' + text.replace('"', '""') + '"', school)
+            else:
+                sql += "WHERE d.school = ? AND d.name LIKE ? ESCAPE '\\' "
+                params = (school, "%" + re.sub(r'([%_\\])', r'\\\1', text) + "%")
+            return db.execute(sql + "ORDER BY d.date DESC, d.meal_code LIMIT ?", (*params, limit)).fetchall()
+
+    def with_allergen(self, school, allergen, month):
+        """month(YYYYMM) 중 allergen 번호가 든 끼니 [(날짜, 끼니 이름, 해당 메뉴들)]"""
+        with self._lock:
+            return self._db().execute("""
+                SELECT d.date, m.meal_name, group_concat(d.name, ', ') FROM dish d
+                JOIN meal m ON m.school = d.school AND m.date = d.date AND m.meal_code = d.meal_code
+                WHERE d.school = ? AND d.date BETWEEN ? AND ? AND d.allergen_mask & ?
+                GROUP BY d.date, d.meal_code ORDER BY d.date, d.meal_code
+            """, (school, f"{month}01", f"{month}31", 1 << allergen)).fetchall()
+
+meal_history = MealHistory()
+
+_meal_repositories = {}  # (교육청 코드, 학교 코드) -> MealRepository
+_meal_repositories_lock = threading.Lock()
+
+def get_meal_repository(tenant=None):
+    """학교별 식단 저장소 (같은 학교를 쓰는 테넌트끼리 공유)"""
+    tenant = tenant or DEFAULT_TENANT
+    key = (tenant.neis_office_code, tenant.neis_school_code)
+    with _meal_repositories_lock:
+        repo = _meal_repositories.get(key)
+        if repo is None:
+            repo = _meal_repositories[key] = MealRepository(*key)
+        return repo
+
+def query_meal_history(tenant=None, text=None, allergen=None, month=None):
+    """식단 기록 검색 결과 출력 (--search-menu / --allergen, NEIS 요청 없이 로컬 색인만 사용)"""
+    repo = get_meal_repository(tenant)
+    repo.sync_history()
+    if text:
+        rows = meal_history.search(repo.school_key, text)
+        if not rows:
+            print(f"'{text}' 기록이 없습니다 (지난 달은 --backfill로 먼저 받아 둘 수 있음)")
+        for date, meal_name, name in rows:
+            print(f"{date[:4]}-{date[4:6]}-{date[6:]} {meal_name}: {name}")
+    if allergen is not None:
+        month = month or datetime.now().strftime('%Y%m')
+        rows = meal_history.with_allergen(repo.school_key, allergen, month)
+        if not rows:
+            print(f"{month}에 알레르기 {allergen}번이 든 끼니가 없습니다")
+        for date, meal_name, names in rows:
+            print(f"{date[:4]}-{date[4:6]}-{date[6:]} {meal_name}: {names}")
+
+def get_meal_menu(meal_code, tenant=None, date=None):
+    """급식 메뉴를 가져옴 (2: 중식, 3: 석식, date: YYYYMMDD, 기본 오늘)"""
+    date = date or datetime.now().strftime('%Y%m%d')
     try:
         logger.info(f"Fetching {'lunch' if meal_code == 2 else 'dinner'} menu...")
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if 'mealServiceDietInfo' in data:
-            menu_items = data['mealServiceDietInfo'][1]['row'][0]['DDISH_NM'].split('<br/>')
-            cleaned_menu = [re.sub(r'\s*\([^)]*\)', '', item.replace('y', '').strip()) for item in menu_items]
-            menu = '\n'.join(cleaned_menu)
+        menu = get_meal_repository(tenant).get_menu(date, meal_code)
+        if menu is not None:
             logger.info(f"{'Lunch' if meal_code == 2 else 'Dinner'} menu fetched successfully.")
         else:
-            menu = None
             logger.warning(f"{'Lunch' if meal_code == 2 else 'Dinner'} menu not found.")
     except Exception as e:
         menu = None
@@ -328,96 +2154,277 @@ def get_meal_menu(meal_code):
 # =========================
 # 급식 이미지 크롤링 및 다운로드 함수
 # =========================
-def fetch_lunch_image_url():
+class _StopParsing(Exception):
+    pass
+
+class LunchSectionParser(HTMLParser):
+    """'오늘의 급식' 제목이 있는 div 안의 첫 이미지만 찾고 바로 멈추는 스트리밍 파서
+
+    전체 DOM을 만들지 않고 열린 div마다 처음 나온 img만 기억하므로
+    홈페이지 크기와 상관없이 필요한 부분까지만 읽는다.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._div_imgs = []  # 열린 div마다 그 안에서 처음 나온 img의 src
+        self._h3_text = None
+        self._section_depth = None
+        self.section_found = False
+        self.img_src = None
+        self.done = False
+
+    def feed(self, data):
+        if self.done:
+            return
+        try:
+            super().feed(data)
+        except _StopParsing:
+            pass
+
+    def _finish(self, img_src):
+        self.img_src = img_src
+        self.done = True
+        raise _StopParsing()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "div":
+            self._div_imgs.append(None)
+        elif tag == "h3":
+            self._h3_text = []
+        elif tag == "img":
+            src = dict(attrs).get("src") or ""
+            if self._section_depth is not None:
+                self._finish(src)
+            if self._div_imgs and self._div_imgs[-1] is None:
+                self._div_imgs[-1] = src
+
+    def handle_endtag(self, tag):
+        if tag == "div" and self._div_imgs:
+            first_img = self._div_imgs.pop()
+            if self._section_depth is not None and len(self._div_imgs) < self._section_depth:
+                # 섹션 div가 닫힐 때까지 이미지가 없었음
+                self._finish(None)
+            # 안쪽 div의 첫 이미지는 바깥 div의 첫 이미지이기도 함
+            if first_img is not None and self._div_imgs and self._div_imgs[-1] is None:
+                self._div_imgs[-1] = first_img
+        elif tag == "h3" and self._h3_text is not None:
+            text = "".join(self._h3_text)
+            self._h3_text = None
+            if "오늘의 급식" in text and self._div_imgs and self._section_depth is None:
+                self.section_found = True
+                if self._div_imgs[-1] is not None:
+                    self._finish(self._div_imgs[-1])
+                self._section_depth = len(self._div_imgs)
+
+    def handle_data(self, data):
+        if self._h3_text is not None:
+            self._h3_text.append(data)
+
+def resolve_lunch_image_url(parser, base_url):
+    """파서 결과를 절대 URL로 변환 (없으면 None)"""
+    if not parser.section_found:
+        logger.warning("오늘의 급식 섹션을 찾지 못했습니다.")
+        return None
+    if not parser.img_src:
+        logger.warning("오늘의 급식 이미지가 없습니다.")
+        return None
+    img_url = parser.img_src
+    if img_url.startswith("/"):
+        img_url = base_url + img_url
+    return img_url
+
+def parse_lunch_image_url(html, base_url):
+    """홈페이지 HTML에서 오늘의 급식 이미지 URL 추출"""
+    parser = LunchSectionParser()
+    parser.feed(html)
+    return resolve_lunch_image_url(parser, base_url)
+
+class LunchImageScraper:
+    """학교 홈페이지의 오늘의 급식 이미지 URL을 조건부 요청으로 가져오고 하루 동안 캐시"""
+    def __init__(self, url=SCHOOL_HOMEPAGE_URL):
+        self._url = url
+        self._lock = threading.Lock()
+        self._etag = None
+        self._last_modified = None
+        self._last_result = None
+        self._resolved = None  # (날짜, 이미지 URL)
+
+    def fetch(self, use_day_cache=True):
+        today = datetime.now().strftime('%Y%m%d')
+        with self._lock:
+            if use_day_cache and self._resolved and self._resolved[0] == today:
+                count_cache("homepage", True)
+                return self._resolved[1]
+            headers = {}
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+            with span("fetch.homepage"), http_transport.stream("GET", self._url, headers=headers) as resp:
+                count_cache("homepage", resp.status_code == 304)
+                if resp.status_code == 304:
+                    logger.info("홈페이지 변경 없음 (304)")
+                    img_url = self._last_result
+                else:
+                    resp.raise_for_status()
+                    with span("parse.homepage"):
+                        parser = LunchSectionParser()
+                        for chunk in resp.iter_text():
+                            parser.feed(chunk)
+                            if parser.done:
+                                break
+                    img_url = resolve_lunch_image_url(parser, self._url)
+                    self._etag = resp.headers.get("ETag")
+                    self._last_modified = resp.headers.get("Last-Modified")
+                    self._last_result = img_url
+            if img_url:
+                self._resolved = (today, img_url)
+            return img_url
+
+_lunch_image_scrapers = {}  # 홈페이지 URL -> LunchImageScraper
+_lunch_image_scrapers_lock = threading.Lock()
+
+def get_lunch_image_scraper(url=SCHOOL_HOMEPAGE_URL):
+    with _lunch_image_scrapers_lock:
+        scraper = _lunch_image_scrapers.get(url)
+        if scraper is None:
+            scraper = _lunch_image_scrapers[url] = LunchImageScraper(url)
+        return scraper
+
+def fetch_lunch_image_url(tenant=None):
     """양정고 오늘의 급식 이미지 URL을 크롤링해서 반환 (httpx 사용)"""
-    url = "https://yangchung.sen.hs.kr"
+    tenant = tenant or DEFAULT_TENANT
+    if not tenant.homepage_url:
+        return None
     try:
-        with httpx.Client(headers=HEADERS, verify=False, timeout=10) as client:
-            resp = client.get(url)
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
-            lunch_section = None
-            for h3 in soup.find_all("h3"):
-                if "오늘의 급식" in h3.text:
-                    lunch_section = h3.find_parent("div")
-                    break
-            if not lunch_section:
-                logger.warning("오늘의 급식 섹션을 찾지 못했습니다.")
-                return None
-            img_tag = lunch_section.find("img")
-            if not img_tag or not img_tag.get("src"):
-                logger.warning("오늘의 급식 이미지가 없습니다.")
-                return None
-            img_url = img_tag["src"]
-            if img_url.startswith("/"):
-                img_url = url + img_url
-            return img_url
+        return get_lunch_image_scraper(tenant.homepage_url).fetch()
     except Exception as e:
         logger.error(f"급식 이미지 크롤링 실패: {e}")
         return None
 
-def download_image(url, save_path):
+def download_image(url, save_path, archive_key=None):
+    """급식 사진을 스트리밍으로 내려받아 저장 (크기/형식 검사, 변경 없으면 재다운로드 생략)"""
     try:
-        with httpx.Client(headers=HEADERS, verify=False, timeout=10) as client:
-            resp = client.get(url)
+        headers = {}
+        source = _photo_sources.get(save_path)
+        if source and source[0] == url and source[1] and os.path.exists(save_path):
+            headers["If-None-Match"] = source[1]
+        with span("fetch.photo"), http_transport.stream("GET", url, headers=headers) as resp:
+            if "If-None-Match" in headers:
+                count_cache("photo", resp.status_code == 304)
+            if resp.status_code == 304:
+                logger.info(f"이미지 변경 없음, 기존 파일 사용: {save_path}")
+                return save_path
             resp.raise_for_status()
-            with open(save_path, "wb") as f:
-                f.write(resp.content)
+            check_photo_response(resp)
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            tmp_path = f"{save_path}.part"
+            received = 0
+            with open(tmp_path, "wb") as f:
+                for chunk in resp.iter_bytes(PHOTO_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > PHOTO_MAX_BYTES:
+                        raise ValueError(f"이미지가 너무 큽니다 (>{PHOTO_MAX_BYTES} bytes)")
+                    f.write(chunk)
+            os.replace(tmp_path, save_path)
+            _photo_sources[save_path] = (url, resp.headers.get("ETag"))
+        image_archive.track_workfile(save_path)
         logger.info(f"이미지 다운로드 완료: {save_path}")
+        if archive_key:
+            archive_photo(save_path, archive_key)
         return save_path
     except Exception as e:
         logger.error(f"이미지 다운로드 실패: {e}")
+        if os.path.exists(f"{save_path}.part"):
+            os.remove(f"{save_path}.part")
         return None
 
+def archive_photo(photo_path, archive_key):
+    """내려받은 급식 사진을 보관소에 저장 (같은 사진을 다시 올린 경우 dHash로 중복 제거)"""
+    try:
+        with open(photo_path, "rb") as f:
+            image_archive.put(*archive_key, f.read(), perceptual=True)
+    except Exception as e:
+        logger.error(f"급식 사진 보관 실패: {e}")
+
+def check_photo_response(resp):
+    """본문을 받기 전에 Content-Type/Content-Length 확인"""
+    content_type = resp.headers.get("Content-Type", "")
+    if not content_type.startswith("image/"):
+        raise ValueError(f"이미지가 아닌 응답입니다: {content_type}")
+    content_length = resp.headers.get("Content-Length")
+    if content_length and int(content_length) > PHOTO_MAX_BYTES:
+        raise ValueError(f"이미지가 너무 큽니다: {content_length} bytes")
+
+# 저장 경로 -> (원본 URL, ETag)
+_photo_sources = {}
+# (원본 URL, ETag) 또는 (경로, 수정 시각, 크기) -> 축소된 급식 사진
+_photo_thumbnails = OrderedDict()
+_photo_thumbnails_lock = threading.Lock()
+
+def load_meal_photo(photo_path, max_size=(900, 900)):
+    """급식 사진을 목표 크기에 가까운 배율로 디코딩(JPEG draft)해 축소본을 캐시"""
+    from PIL import Image
+    source = _photo_sources.get(photo_path)
+    if source and source[1]:
+        key = (source[0], source[1], max_size)
+    else:
+        stat = os.stat(photo_path)
+        key = (photo_path, stat.st_mtime_ns, stat.st_size, max_size)
+    with _photo_thumbnails_lock:
+        hit = key in _photo_thumbnails
+        if hit:
+            _photo_thumbnails.move_to_end(key)
+            meal_img = _photo_thumbnails[key]
+    count_cache("thumbnail", hit)
+    if hit:
+        return meal_img
+    with span("decode.photo"), Image.open(photo_path) as img:
+        # JPEG는 1/2, 1/4, 1/8 배율로 바로 디코딩해서 원본 해상도 전체를 메모리에 올리지 않음
+        img.draft("RGB", max_size)
+        meal_img = img.convert("RGB")
+    meal_img.thumbnail(max_size, Image.LANCZOS)
+    with _photo_thumbnails_lock:
+        _photo_thumbnails[key] = meal_img
+        while len(_photo_thumbnails) > PHOTO_THUMB_CACHE_SIZE:
+            _photo_thumbnails.popitem(last=False)
+    return meal_img
+
 # =========================
 # 급식 이미지 템플릿 합성 함수
 # =========================
-def create_menu_story_image_with_photo(menu_text, meal_type, photo_path, suffix):
-    """급식 텍스트와 급식 이미지를 합성하여 스토리용 이미지 생성"""
-    if menu_text is None or photo_path is None:
-        return None
+def render_menu_story_image_with_photo(menu_text, meal_type, photo_path):
+    from PIL import ImageDraw
     # 배경
-    image = Image.new('RGB', (1080, 1920), (255, 255, 255))
+    image = blank_layer().copy()
     draw = ImageDraw.Draw(image)
-    font = load_font(FONT_PATH, 60)
-    # 텍스트
+    # 텍스트 (아래 사진 영역을 침범하지 않는 크기로)
     full_text = f"{meal_type}\n\n{menu_text}"
-    text_bbox = draw.textbbox((0, 0), full_text, font=font)
-    text_x = (1080 - (text_bbox[2] - text_bbox[0])) / 2
     text_y = 200
+    font = fit_font(full_text, 1080 - 2 * STORY_MARGIN, 1920 - text_y - 80 - 900 - STORY_MARGIN)
+    text_bbox = measure_text(full_text, font)
+    text_x = (1080 - (text_bbox[2] - text_bbox[0])) / 2
     draw.text((text_x, text_y), full_text, fill=(0,0,0), font=font)
     # 급식 이미지 삽입 (비율 유지, 여백)
     try:
-        meal_img = Image.open(photo_path).convert("RGB")
         # 최대 크기(여백 포함)
-        max_w, max_h = 900, 900
-        meal_img.thumbnail((max_w, max_h), Image.LANCZOS)
+        meal_img = load_meal_photo(photo_path, (900, 900))
         # 중앙 배치 (텍스트 아래)
         img_x = (1080 - meal_img.width) // 2
         img_y = text_y + (text_bbox[3] - text_bbox[1]) + 80
         image.paste(meal_img, (img_x, img_y))
     except Exception as e:
         logger.error(f"급식 이미지 합성 실패: {e}")
-    today = datetime.now().strftime('%Y%m%d')
-    image_path = f'{IG_IMAGE_PATH}/{today}{suffix}_photo.jpg'
-    os.makedirs(os.path.dirname(image_path), exist_ok=True)
-    image.save(image_path)
-    logger.info(f"Menu+Photo story image created: {image_path}")
-    return image_path
+    return image
 
 # =========================
 # 급식 이미지만 합성 함수 (텍스트 없이)
 # =========================
-def create_menu_photo_story_image(photo_path, suffix, menu_text=None):
-    """이미지는 상단(중앙), 메뉴 텍스트(중식 제외)는 하단에 폰트 작게 배치"""
-    if photo_path is None:
-        return None
-    image = Image.new('RGB', (1080, 1920), (255, 255, 255))
+def render_menu_photo_story_image(photo_path, menu_text=None):
+    from PIL import ImageDraw
+    image = blank_layer().copy()
     # 1. 이미지 상단 중앙 배치
     try:
-        meal_img = Image.open(photo_path).convert("RGB")
-        max_w, max_h = 900, 900
-        meal_img.thumbnail((max_w, max_h), Image.LANCZOS)
+        meal_img = load_meal_photo(photo_path, (900, 900))
         img_x = (1080 - meal_img.width) // 2
         img_y = 120  # 상단 여백
         image.paste(meal_img, (img_x, img_y))
@@ -436,162 +2443,1062 @@ def create_menu_photo_story_image(photo_path, suffix, menu_text=None):
         total_height = len(lines) * 55
         start_y = 1920 - total_height - 80  # 하단에서 80px 위
         for i, line in enumerate(lines):
-            bbox = draw.textbbox((0,0), line, font=font)
+            bbox = measure_text(line, font)
             width = bbox[2] - bbox[0]
             x = (1080 - width) // 2
             y = start_y + i * 55
             draw.text((x, y), line, fill=(30,30,30), font=font)
-    today = datetime.now().strftime('%Y%m%d')
-    image_path = f'{IG_IMAGE_PATH}/{today}{suffix}_photo_only.jpg'
-    os.makedirs(os.path.dirname(image_path), exist_ok=True)
-    image.save(image_path)
-    logger.info(f"Menu photo-only story image created: {image_path}")
-    return image_path
+    return image
 
 # =========================
-# SSL 에러 우회 크롤링
+# 날짜 범위 미리 생성 (--backfill / --pregenerate)
 # =========================
-def fetch_lunch_image_url_ssl_safe():
-    url = "https://yangchung.sen.hs.kr"
-    try:
-        return fetch_lunch_image_url()
-    except Exception as e:
-        logger.warning(f"SSL/기타 에러 발생, 인증서 검증 없이 재시도: {e}")
+def parse_date_range(text):
+    """'YYYYMMDD..YYYYMMDD' (YYYY-MM-DD도 가능, 날짜 하나만 써도 됨) -> 날짜 목록"""
+    start_text, _, end_text = text.partition("..")
+    start = datetime.strptime(start_text.replace("-", ""), '%Y%m%d')
+    end = datetime.strptime((end_text or start_text).replace("-", ""), '%Y%m%d')
+    if end < start:
+        raise ValueError(f"invalid date range: {text}")
+    return [(start + timedelta(days=i)).strftime('%Y%m%d') for i in range((end - start).days + 1)]
+
+def upcoming_dates(days, start=None):
+    """내일부터 days일치 날짜 목록"""
+    start = start or datetime.now() + timedelta(days=1)
+    return [(start + timedelta(days=i)).strftime('%Y%m%d') for i in range(days)]
+
+def pregenerate_stories(dates, tenants=None):
+    """기간 내 중식/석식 스토리를 한꺼번에 만들어 보관소와 렌더링 캐시에 넣고 만든 스토리 수 반환
+
+    식단은 달마다 한 번의 요청으로 받고, 모든 학교/날짜의 스토리를 한 번의 프로세스 풀로
+    렌더링한다. 당일 작업은 같은 입력 지문으로 렌더링 캐시에서 바로 꺼내 올린다.
+    """
+    dates = sorted(dates)
+    months = sorted({date[:6] for date in dates})
+    specs, targets = [], []  # 렌더링할 (함수, 인자), 결과별 [(날짜, 보관소 키)]
+    spec_index = {}
+    for tenant in tenants or [DEFAULT_TENANT]:
+        repo = get_meal_repository(tenant)
         try:
-            with httpx.Client(headers=HEADERS, verify=False, timeout=10) as client:
-                resp = client.get(url)
-                resp.raise_for_status()
-                soup = BeautifulSoup(resp.text, "html.parser")
-                lunch_section = None
-                for h3 in soup.find_all("h3"):
-                    if "오늘의 급식" in h3.text:
-                        lunch_section = h3.find_parent("div")
-                        break
-                if not lunch_section:
-                    logger.warning("오늘의 급식 섹션을 찾지 못했습니다.")
-                    return None
-                img_tag = lunch_section.find("img")
-                if not img_tag or not img_tag.get("src"):
-                    logger.warning("오늘의 급식 이미지가 없습니다.")
-                    return None
-                img_url = img_tag["src"]
-                if img_url.startswith("/"):
-                    img_url = url + img_url
-                return img_url
-        except Exception as e2:
-            logger.error(f"SSL 우회 후에도 급식 이미지 크롤링 실패: {e2}")
-            return None
+            for month in months:
+                if not repo.is_fresh(month):
+                    repo.refresh_month(month)
+            menus = [(date, meal_type, kind, repo.get_menu(date, meal_code)) for date in dates
+                     for meal_code, meal_type, kind in ((2, "중식", "lunch"), (3, "석식", "dinner"))]
+        except Exception as e:
+            logger.error(f"[{tenant.name}] Meal fetch failed, skipping: {e}")
+            continue
+        for date, meal_type, kind, menu in menus:
+            if not menu:
+                continue
+            # 같은 학교를 쓰는 학교끼리는 같은 메뉴를 한 번만 렌더링
+            args = (menu, meal_type)
+            if args not in spec_index:
+                spec_index[args] = len(specs)
+                specs.append((build_story, (render_menu_image, args)))
+                targets.append([])
+            targets[spec_index[args]].append((date, story_key(kind, date, tenant)))
+    if not specs:
+        logger.warning(f"No menus found for {dates[0]}..{dates[-1]}")
+        return 0
+    with span("pregenerate", stories=len(specs), days=len(dates)):
+        stories = render_stories(specs)
+    for story, keys in zip(stories, targets):
+        for date, key in keys:
+            fingerprint_store.hold_rendered(story.fingerprint, date)
+            image_archive.put(*key, story)
+    count = sum(len(keys) for keys in targets)
+    logger.info(f"Pregenerated {count} stories ({len(specs)} rendered) for {dates[0]}..{dates[-1]}")
+    return count
 
 # =========================
 # 세분화된 업로드 함수
 # =========================
-def upload_menu_story():
-    bot = InstagramBot()
-    lunch_menu = get_meal_menu(2)
+def upload_menu_story(tenant=None):
+    lunch_menu = get_meal_menu(2, tenant)
+    dinner_menu = get_meal_menu(3, tenant)
+    stories = render_daily_stories(lunch_menu, dinner_menu, tenant=tenant)
     if lunch_menu:
-        lunch_image_path = create_menu_image(lunch_menu, "중식", "_lunch")
-        upload_story(bot, lunch_image_path)
-    dinner_menu = get_meal_menu(3)
+        enqueue_story(stories["lunch"], "lunch", tenant)
     if dinner_menu:
-        dinner_image_path = create_menu_image(dinner_menu, "석식", "_dinner")
-        upload_story(bot, dinner_image_path)
+        enqueue_story(stories["dinner"], "dinner", tenant)
 
-def upload_menu_image_story():
-    bot = InstagramBot()
-    lunch_menu = get_meal_menu(2)
-    img_url = fetch_lunch_image_url()
+def upload_menu_image_story(tenant=None):
+    tenant = tenant or DEFAULT_TENANT
+    lunch_menu = get_meal_menu(2, tenant)
+    img_url = fetch_lunch_image_url(tenant)
     if lunch_menu and img_url:
         today = datetime.now().strftime('%Y%m%d')
-        photo_path = f'{IG_IMAGE_PATH}/{today}_lunch_photo.jpg'
-        download_image(img_url, photo_path)
-        story_img_path = create_menu_story_image_with_photo(lunch_menu, "중식", photo_path, "_lunch")
-        upload_story(bot, story_img_path)
-
-def upload_weather_story():
-    bot = InstagramBot()
-    weather_data = get_weather_data()
+        photo_path = f'{tenant.image_dir}/{today}_lunch_photo.jpg'
+        download_image(img_url, photo_path, story_key("lunch_photo", tenant=tenant))
+        story = build_story(render_menu_story_image_with_photo, (lunch_menu, "중식", photo_path),
+                            story_key("lunch_with_photo", tenant=tenant))
+        enqueue_story(story, "lunch_with_photo", tenant)
+
+def upload_weather_story(tenant=None):
+    weather_data = get_weather_data(tenant)
     if weather_data:
-        weather_image = create_weather_image(weather_data)
-        upload_story(bot, weather_image)
+        weather_story = build_story(render_weather_image, (weather_data,), story_key("weather", tenant=tenant))
+        enqueue_story(weather_story, "weather", tenant)
 
 # =========================
 # 07:00/11:50 스케줄 분리
 # =========================
-def job_text_menu_weather():
-    bot = InstagramBot()
+def job_text_menu_weather(tenant=None):
+    with job_trace(job_name("text_menu_weather", tenant)):
+        if PIPELINE_MODE == "async":
+            import asyncio
+            asyncio.run(run_morning_pipeline(tenant))
+            return
+        publish_text_menu_weather(prepare_text_menu_weather(tenant), tenant)
+
+def job_name(job, tenant=None):
+    if tenant and tenant.name != DEFAULT_TENANT_NAME:
+        return f"{tenant.name}/{job}"
+    return job
+
+def prepare_text_menu_weather(tenant=None):
+    """07:00 스토리 준비: 중식/석식/날씨를 가져와 동시에 렌더링 ({종류: JPEG 바이트})"""
+    if PIPELINE_MODE == "async":
+        import asyncio
+        return asyncio.run(run_morning_pipeline(tenant, enqueue=False))
+    lunch_menu = get_meal_menu(2, tenant)
+    dinner_menu = get_meal_menu(3, tenant)
+    # 날씨는 중식이 있는 날만
+    weather_data = get_weather_data(tenant) if lunch_menu else None
+    return render_daily_stories(lunch_menu, dinner_menu, weather_data, tenant)
+
+def publish_text_menu_weather(stories, tenant=None):
+    """중식 -> 날씨 -> 석식 순서로 대기열에 넣음 (업로드 간격은 업로더가 맞춤)"""
     # 중식 텍스트
-    lunch_menu = get_meal_menu(2)
-    if lunch_menu:
-        lunch_image_path = create_menu_image(lunch_menu, "중식", "_lunch")
-        upload_story(bot, lunch_image_path)
-        time.sleep(10)
+    if stories.get("lunch"):
+        enqueue_story(stories["lunch"], "lunch", tenant)
         # 날씨
-        weather_data = get_weather_data()
-        if weather_data:
-            weather_image = create_weather_image(weather_data)
-            upload_story(bot, weather_image)
+        if stories.get("weather"):
+            enqueue_story(stories["weather"], "weather", tenant)
     # 석식 텍스트
-    dinner_menu = get_meal_menu(3)
-    if dinner_menu:
-        dinner_image_path = create_menu_image(dinner_menu, "석식", "_dinner")
-        upload_story(bot, dinner_image_path)
+    if stories.get("dinner"):
+        enqueue_story(stories["dinner"], "dinner", tenant)
 
-def job_lunch_photo_only_story():
-    lunch_menu = get_meal_menu(2)
-    if lunch_menu:
-        img_url = fetch_lunch_image_url_ssl_safe()
-        if img_url:
-            today = datetime.now().strftime('%Y%m%d')
-            photo_path = f'{IG_IMAGE_PATH}/{today}_lunch_photo.jpg'
-            download_image(img_url, photo_path)
-            # 메뉴 텍스트에서 '중식' 제외하여 하단에 표시
-            story_img_path = create_menu_photo_story_image(photo_path, "_lunch", menu_text=lunch_menu)
-            bot = InstagramBot()
-            upload_story(bot, story_img_path)
+# =========================
+# 급식 사진 감시 (올라오는 즉시 게시)
+# =========================
+class PhotoWatchState:
+    """학교별로 마지막에 게시한(또는 기준으로 삼은) 급식 사진(게시 날짜, URL, 내용 해시) 기록"""
+    def __init__(self, path=None):
+        self._path = path or PHOTO_WATCH_STATE_PATH
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _load(self):
+        if self._state is None:
+            try:
+                with open(self._path, encoding="utf-8") as f:
+                    self._state = json.load(f)
+            except FileNotFoundError:
+                self._state = {}
+            except Exception as e:
+                logger.warning(f"급식 사진 감시 기록을 읽지 못했습니다: {e}")
+                self._state = {}
+        return self._state
+
+    def get(self, name):
+        with self._lock:
+            return self._load().get(name)
+
+    def record(self, name, date, url, digest):
+        with self._lock:
+            state = self._load()
+            state[name] = {"date": date, "url": url, "sha256": digest}
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._path)
+
+photo_watch_state = PhotoWatchState()
+
+def at_time(now, hhmm):
+    hour, minute = map(int, hhmm.split(":"))
+    return now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+class PhotoWatcher:
+    """홈페이지 '오늘의 급식'에 새 사진이 올라오는지 조건부 요청으로 확인하다가 올라오면 바로 합성해 대기열에 넣음
+
+    사진이 올라올 것으로 예상되는 시각(tenant.photo_time) 앞뒤 PHOTO_WATCH_HOT_MINUTES분은
+    PHOTO_POLL_MIN초마다, 그 밖에서는 바뀌지 않을 때마다 간격을 늘려 PHOTO_POLL_MAX초까지 확인한다.
+    사진은 URL이 같아도 조건부 요청(ETag)으로 다시 받아 내용 해시로 비교하고, 마지막 사진과 해시가 같으면
+    새 사진이 아니다. 기록이 없으면(첫 배포, 캐시 삭제) 처음 본 사진은 전날 것일 수 있으므로 게시하지 않고
+    기준으로만 기록한다. 마감 시각(tenant.photo_cutoff)까지 못 찾으면 그날 사진 스토리는 건너뛴다.
+    """
+    def __init__(self, tenant=None):
+        self.tenant = tenant or DEFAULT_TENANT
+        self.polls = 0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def next_interval(self, interval, now):
+        """다음 확인까지 기다릴 시간(초): 예상 시각 근처면 최소 간격, 아니면 점점 늘림"""
+        expected = at_time(now, self.tenant.photo_time)
+        hot = timedelta(minutes=PHOTO_WATCH_HOT_MINUTES)
+        if expected - hot <= now <= expected + hot:
+            return PHOTO_POLL_MIN
+        interval = min(PHOTO_POLL_MAX, interval * 1.5)
+        if now < expected - hot:
+            # 늘어난 간격 때문에 예상 시각 구간에 늦게 들어가지 않도록
+            interval = min(interval, max(PHOTO_POLL_MIN, (expected - hot - now).total_seconds()))
+        return interval
+
+    def poll(self, lunch_menu, today):
+        """한 번 확인해서 새 사진이면 게시하고 True"""
+        tenant = self.tenant
+        self.polls += 1
+        img_url = get_lunch_image_scraper(tenant.homepage_url).fetch(use_day_cache=False)
+        if not img_url:
+            return False
+        last = photo_watch_state.get(tenant.name)
+        photo_path = f'{tenant.image_dir}/{today}_lunch_photo.jpg'
+        # 같은 주소에 사진만 바꿔 올리는 학교도 있으므로 주소가 같아도 받아서(바뀌지 않았으면 304) 내용으로 비교
+        if not download_image(img_url, photo_path):
+            return False
+        with open(photo_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if last is None:
+            photo_watch_state.record(tenant.name, "", img_url, digest)
+            logger.info(f"[{tenant.name}] 급식 사진 감시 기록이 없어 지금 사진을 기준으로 삼습니다 (게시하지 않음): {img_url}")
+            return False
+        if last["sha256"] == digest:
+            if last["url"] != img_url:
+                # 주소만 바뀐 같은 사진
+                photo_watch_state.record(tenant.name, last["date"], img_url, digest)
+            return False
+        archive_photo(photo_path, story_key("lunch_photo", today, tenant))
+        story = build_story(render_menu_photo_story_image, (photo_path, lunch_menu),
+                            story_key("lunch_photo_only", today, tenant))
+        enqueue_story(story, "lunch_photo_only", tenant)
+        photo_watch_state.record(tenant.name, today, img_url, digest)
+        logger.info(f"[{tenant.name}] New lunch photo detected after {self.polls} check(s): {img_url}")
+        return True
+
+    def run(self):
+        """사진을 게시하면 True, 메뉴가 없거나 마감까지 사진이 없으면 False"""
+        with job_trace(job_name("lunch_photo_only_story", self.tenant)):
+            return self._run()
+
+    def _run(self):
+        tenant = self.tenant
+        today = datetime.now().strftime('%Y%m%d')
+        last = photo_watch_state.get(tenant.name)
+        if last and last["date"] == today:
+            logger.info(f"[{tenant.name}] Lunch photo already posted today.")
+            return True
+        if not tenant.homepage_url:
+            return False
+        lunch_menu = get_meal_menu(2, tenant)
+        if not lunch_menu:
+            logger.info(f"[{tenant.name}] No lunch today, photo watch skipped.")
+            return False
+        cutoff = at_time(datetime.now(), tenant.photo_cutoff)
+        interval = PHOTO_POLL_MIN
+        while not self._stopped.is_set():
+            now = datetime.now()
+            if now >= cutoff:
+                metrics.inc("lunchbot_photo_watch_missed_total", tenant=tenant.name)
+                logger.warning(f"[{tenant.name}] 급식 사진이 {tenant.photo_cutoff}까지 올라오지 않아 오늘 사진 스토리는 건너뜁니다 ({self.polls}회 확인)")
+                return False
+            try:
+                with span("photo_watch.poll", tenant=tenant.name):
+                    if self.poll(lunch_menu, today):
+                        return True
+                interval = self.next_interval(interval, now)
+            except Exception as e:
+                interval = min(PHOTO_POLL_MAX, interval * 2)
+                logger.warning(f"[{tenant.name}] 급식 사진 확인 실패, {interval:.0f}초 후 다시 확인: {e}")
+            self._stopped.wait(max(0, min(interval, (cutoff - datetime.now()).total_seconds())))
+        return False
+
+_photo_watchers = {}  # 학교 이름 -> 감시 스레드
+_photo_watchers_lock = threading.Lock()
+
+def start_photo_watch(tenant=None):
+    """학교별 급식 사진 감시를 백그라운드 스레드로 시작 (이미 돌고 있으면 그대로 둠)"""
+    tenant = tenant or DEFAULT_TENANT
+    with _photo_watchers_lock:
+        thread = _photo_watchers.get(tenant.name)
+        if thread is not None and thread.is_alive():
+            return thread
+        thread = _photo_watchers[tenant.name] = threading.Thread(
+            target=PhotoWatcher(tenant).run, name=f"photo-watch-{tenant.name}", daemon=True)
+        thread.start()
+    logger.info(f"[{tenant.name}] Lunch photo watch started (cutoff {tenant.photo_cutoff}).")
+    return thread
+
+def photo_watch_start(tenant):
+    """감시 시작 시각 HH:MM (예상 게시 시각 PHOTO_WATCH_LEAD_MINUTES분 전)"""
+    return (at_time(datetime.now(), tenant.photo_time) - timedelta(minutes=PHOTO_WATCH_LEAD_MINUTES)).strftime("%H:%M")
 
 # =========================
-# 스토리 업로드 및 전체 플로우
+# 비동기 아침 파이프라인 (PIPELINE_MODE=async)
 # =========================
-def upload_story(bot, image_path):
-    if image_path:
-        bot.upload_story(image_path)
+async def async_fetch_month_meals(client, month, tenant=None):
+    """한 달치 식단을 비동기로 받아 학교별 식단 저장소에 저장"""
+    import asyncio
+    repo = get_meal_repository(tenant)
+    if repo.is_fresh(month):
+        return
+    from_ymd, to_ymd = month_range(month)
+    rows = []
+    page = 1
+    while True:
+        resp = await client.get(neis_meal_url(from_ymd, to_ymd, page, repo.office_code, repo.school_code))
+        resp.raise_for_status()
+        page_rows, total = parse_meal_page(resp.json())
+        rows.extend(page_rows)
+        if not page_rows or len(rows) >= total:
+            break
+        page += 1
+    await asyncio.to_thread(repo.store_month, month, rows)
 
-def fetch_and_upload_menu():
-    bot = InstagramBot()
-    # 중식
-    lunch_menu = get_meal_menu(2)
-    if lunch_menu:
-        lunch_image_path = create_menu_image(lunch_menu, "중식", "_lunch")
-        upload_story(bot, lunch_image_path)
-        time.sleep(10)
-        # 날씨 정보
-        weather_data = get_weather_data()
-        if weather_data:
-            weather_image = create_weather_image(weather_data)
-            upload_story(bot, weather_image)
-    # 석식
-    dinner_menu = get_meal_menu(3)
-    if dinner_menu:
-        dinner_image_path = create_menu_image(dinner_menu, "석식", "_dinner")
-        upload_story(bot, dinner_image_path)
+async def async_get_weather_data(client, now, tenant=None):
+    """아직 없는 최신 초단기예보 발표분을 비동기로 받아 저장소에 넣은 뒤 요약 반환"""
+    import asyncio
+    tenant = tenant or DEFAULT_TENANT
+    base_date, base_time = get_forecast_base(now)
+    stored = await asyncio.to_thread(forecast_store.has_base, tenant.nx, tenant.ny, base_date + base_time)
+    count_cache("forecast", stored)
+    if not stored:
+        try:
+            resp = await client.get(forecast_url(base_date, base_time, tenant.nx, tenant.ny))
+            resp.raise_for_status()
+            await asyncio.to_thread(forecast_store.store, tenant.nx, tenant.ny, base_date + base_time, resp.json())
+        except Exception as e:
+            logger.error(f"Weather fetch failed for base {base_date}{base_time}, using stored forecasts: {e}")
+    return await asyncio.to_thread(forecast_store.summary, tenant.nx, tenant.ny, now)
+
+async def async_prefetch_lunch_photo(client, photo_path, homepage_url=SCHOOL_HOMEPAGE_URL):
+    """홈페이지에 급식 사진이 올라와 있으면 미리 내려받아 둠
+
+    07:00에는 대개 어제 사진이므로 보관소에는 넣지 않는다 (새 사진인지 확인한 감시/게시 단계에서 보관).
+    """
+    import asyncio
+    if not homepage_url:
+        return None
+    parser = LunchSectionParser()
+    async with client.stream("GET", homepage_url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_text():
+            parser.feed(chunk)
+            if parser.done:
+                break
+    img_url = resolve_lunch_image_url(parser, homepage_url)
+    if not img_url:
+        return None
+    os.makedirs(os.path.dirname(photo_path), exist_ok=True)
+    async with client.stream("GET", img_url) as resp:
+        resp.raise_for_status()
+        check_photo_response(resp)
+        tmp_path = f"{photo_path}.part"
+        received = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                async for chunk in resp.aiter_bytes(PHOTO_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > PHOTO_MAX_BYTES:
+                        raise ValueError(f"이미지가 너무 큽니다 (>{PHOTO_MAX_BYTES} bytes)")
+                    f.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, photo_path)
+        _photo_sources[photo_path] = (img_url, resp.headers.get("ETag"))
+    await asyncio.to_thread(image_archive.track_workfile, photo_path)
+    logger.info(f"이미지 다운로드 완료: {photo_path}")
+    return photo_path
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def run_morning_pipeline(tenant=None, enqueue=True):
+    """중식/석식/날씨/급식 사진을 동시에 가져오고 도착하는 대로 렌더링한 뒤 순서대로 대기열에 넣음
+
+    enqueue=False면 대기열에 넣지 않고 {종류: 스토리}만 돌려줌 (스케줄러 준비 단계용)
+    """
+    import asyncio
+    tenant = tenant or DEFAULT_TENANT
+    now = datetime.now()
+    today = now.strftime('%Y%m%d')
+    async with AsyncHttpSession(http_transport) as client:
+        # 1. 모든 입력을 동시에 요청 (중식/석식은 한 달치 한 번의 요청으로 함께 받음)
+        meals_task = asyncio.ensure_future(async_fetch_month_meals(client, today[:6], tenant))
+        weather_task = asyncio.ensure_future(async_get_weather_data(client, now, tenant))
+        photo_task = asyncio.ensure_future(
+            async_prefetch_lunch_photo(client, f'{tenant.image_dir}/{today}_lunch_photo.jpg', tenant.homepage_url)
+        )
+
+        # 2. 입력이 도착하는 대로 렌더링 시작
+        async def render_menu(meal_code, meal_type, kind):
+            try:
+                await meals_task
+            except Exception as e:
+                # 캐시에 남아 있는 식단으로 계속 진행
+                logger.error(f"Error fetching meal menu: {e}")
+            menu = await asyncio.to_thread(get_meal_menu, meal_code, tenant)
+            if not menu:
+                return None
+            return await asyncio.to_thread(build_story, render_menu_image, (menu, meal_type),
+                                           story_key(kind, tenant=tenant))
+
+        async def render_weather():
+            try:
+                weather_data = await weather_task
+            except Exception as e:
+                logger.error(f"Weather error: {e}", exc_info=True)
+                return None
+            if not weather_data:
+                return None
+            return await asyncio.to_thread(build_story, render_weather_image, (weather_data,),
+                                           story_key("weather", tenant=tenant))
 
-def generate_weather_image():
-    weather_data = get_weather_data()
+        lunch_render = asyncio.ensure_future(render_menu(2, "중식", "lunch"))
+        dinner_render = asyncio.ensure_future(render_menu(3, "석식", "dinner"))
+        weather_render = asyncio.ensure_future(render_weather())
+        tasks = (meals_task, weather_task, photo_task, lunch_render, dinner_render, weather_render)
+
+        try:
+            # 3. 대기열 순서는 동기 방식과 동일 (중식 -> 날씨 -> 석식)
+            stories = {"lunch": await lunch_render}
+            if stories["lunch"]:
+                if enqueue:
+                    await asyncio.to_thread(enqueue_story, stories["lunch"], "lunch", tenant)
+                stories["weather"] = await weather_render
+                if enqueue and stories["weather"]:
+                    await asyncio.to_thread(enqueue_story, stories["weather"], "weather", tenant)
+            stories["dinner"] = await dinner_render
+            if enqueue and stories["dinner"]:
+                await asyncio.to_thread(enqueue_story, stories["dinner"], "dinner", tenant)
+            try:
+                await photo_task
+            except Exception as e:
+                logger.warning(f"급식 사진 미리 받기 실패: {e}")
+        finally:
+            # 쓰지 않은 요청(중식이 없을 때의 날씨 등)도 세션을 닫기 전에 모두 취소하고 끝날 때까지 기다림
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return stories
+
+# =========================
+# 스토리 업로드 및 전체 플로우
+# =========================
+def upload_story(bot, story):
+    """스토리 업로드 (오늘 같은 계정에 같은 지문을 이미 올렸으면 건너뜀), 올렸으면 True"""
+    if not story:
+        return False
+    fingerprint = getattr(story, "fingerprint", None)
+    if fingerprint and not fingerprint_store.reserve(fingerprint, bot.username):
+        logger.info(f"Story already posted today, skipping: {fingerprint[:12]}")
+        return False
+    try:
+        bot.upload_story(story)
+    except BaseException:
+        if fingerprint:
+            fingerprint_store.release(fingerprint, bot.username)
+        raise
+    if fingerprint:
+        fingerprint_store.mark_posted(fingerprint, bot.username)
+    return True
+
+def generate_weather_image(tenant=None):
+    weather_data = get_weather_data(tenant)
     if weather_data:
         return create_weather_image(weather_data, "./weather.png")
     return None
 
-def job():
-    fetch_and_upload_menu()
+# =========================
+# 업로드 대기열 (아웃박스)
+# =========================
+class UploadOutbox:
+    """업로드할 스토리를 계정별로 넣은 순서대로 보관하는 SQLite 대기열
+
+    렌더링 단계는 넣기만 하고 업로드는 OutboxUploader가 따로 처리한다. 보내는 중(sending) 항목은
+    가져간 프로세스(owner)가 죽었거나 임대가 끝났을 때만 대기(pending)로 되돌리므로, 프로세스가 죽어도
+    그날 스토리를 잃지 않고 데몬 옆에서 도는 1회 실행 명령이 데몬이 올리는 중인 항목을 건드리지도 않는다.
+    """
+    def __init__(self, path=None):
+        self._path = path or OUTBOX_PATH
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            if self._path != ":memory:":
+                os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tenant TEXT, account TEXT, kind TEXT, day TEXT,
+                    story BLOB, fingerprint TEXT,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    not_before REAL, created_at REAL, sent_at REAL, last_error TEXT,
+                    owner TEXT, lease_until REAL, job TEXT
+                );
+                CREATE INDEX IF NOT EXISTS outbox_account ON outbox (account, state, id);
+            """)
+            # 임대/작업 열이 없던 이전 버전의 대기열 파일
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL"), ("job", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {kind}")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, tenant, kind, story):
+        """스토리를 넣고 id 반환 (같은 계정에 같은 지문이 대기 중이거나 오늘 이미 올렸으면 None)
+
+        넣은 작업(job_trace) 이름도 함께 기록해 업로드 단계 요약을 그 작업 이름으로 남긴다.
+        """
+        fingerprint = getattr(story, "fingerprint", None)
+        if fingerprint and fingerprint_store.was_posted(fingerprint, tenant.ig_username):
+            logger.info(f"Story already posted today, not queueing: {fingerprint[:12]}")
+            return None
+        now = time.time()
+        job = _current_job.get()
+        with self._lock:
+            db = self._db()
+            with db:
+                if fingerprint and db.execute(
+                    "SELECT 1 FROM outbox WHERE account = ? AND fingerprint = ? AND state IN ('pending', 'sending')",
+                    (tenant.ig_username, fingerprint),
+                ).fetchone():
+                    logger.info(f"Story already queued, skipping: {fingerprint[:12]}")
+                    return None
+                item_id = db.execute(
+                    "INSERT INTO outbox (tenant, account, kind, day, story, fingerprint, not_before, created_at, job) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (tenant.name, tenant.ig_username, kind, datetime.now().strftime('%Y%m%d'),
+                     sqlite3.Binary(story), fingerprint, now, now, job["name"] if job else None),
+                ).lastrowid
+        metrics.inc("lunchbot_outbox_enqueued_total", kind=kind)
+        logger.info(f"Story queued for upload: {tenant.name}/{kind} (#{item_id})")
+        return item_id
+
+    def recover(self):
+        """보내다 만 항목 중 가져간 프로세스가 죽었거나 임대가 끝난 것을 대기 상태로 되돌림
+
+        업로드 스레드가 하나뿐이고 이 메서드는 그 스레드가 돌기 전이나 그 스레드의 claim() 전에만 부르므로
+        이 프로세스 값으로 남은 항목도 보내다 만 것이다.
+        """
+        token, now = process_token(), time.time()
+        with self._lock:
+            db = self._db()
+            with db:
+                stale = [
+                    item_id for item_id, owner, lease_until in db.execute(
+                        "SELECT id, owner, lease_until FROM outbox WHERE state = 'sending'"
+                    )
+                    if owner == token or (lease_until or 0) < now or not owner_alive(owner)
+                ]
+                count = sum(
+                    db.execute("UPDATE outbox SET state = 'pending', owner = NULL WHERE id = ? AND state = 'sending'",
+                               (item_id,)).rowcount
+                    for item_id in stale
+                )
+        if count:
+            logger.warning(f"Recovered {count} interrupted upload(s) from outbox")
+        return count
+
+    def expire(self, today):
+        """오늘보다 이전 날짜의 대기 항목은 올리지 않고 만료 처리"""
+        with self._lock:
+            db = self._db()
+            with db:
+                count = db.execute(
+                    "UPDATE outbox SET state = 'expired', story = NULL WHERE state = 'pending' AND day < ?", (today,)
+                ).rowcount
+        if count:
+            logger.warning(f"Expired {count} stale story(ies) in outbox")
+        return count
+
+    def next_due(self, interval):
+        """계정별 맨 앞 항목 중 가장 먼저 보낼 수 있는 것과 그 시각 (계정마다 마지막 업로드 후 interval초 간격)"""
+        with self._lock:
+            heads = self._db().execute("""
+                SELECT o.id, o.tenant, o.kind, o.fingerprint, o.attempts, o.job, o.not_before,
+                       (SELECT MAX(d.sent_at) FROM outbox d WHERE d.account = o.account AND d.state = 'done')
+                FROM outbox o
+                WHERE o.state = 'pending' AND o.id = (
+                    SELECT MIN(h.id) FROM outbox h WHERE h.account = o.account AND h.state IN ('pending', 'sending')
+                )
+            """).fetchall()
+        best, best_at = None, None
+        for row in heads:
+            ready_at = max(row[6], (row[7] or 0) + interval)
+            if best_at is None or ready_at < best_at:
+                best, best_at = row[:6], ready_at
+        return best, best_at
+
+    def claim(self, item_id):
+        """이 프로세스가 보내는 중으로 표시(임대)하고 스토리 바이트 반환"""
+        with self._lock:
+            db = self._db()
+            with db:
+                if not db.execute(
+                    "UPDATE outbox SET state = 'sending', owner = ?, lease_until = ? WHERE id = ? AND state = 'pending'",
+                    (process_token(), time.time() + OUTBOX_LEASE, item_id),
+                ).rowcount:
+                    return None
+                return db.execute("SELECT story FROM outbox WHERE id = ?", (item_id,)).fetchone()[0]
+
+    def done(self, item_id, sent=True):
+        """완료 처리 (올리지 않고 건너뛴 경우 sent=False, 간격 계산에 넣지 않음)"""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("UPDATE outbox SET state = 'done', story = NULL, sent_at = ? WHERE id = ?",
+                           (now if sent else None, item_id))
+                db.execute("DELETE FROM outbox WHERE state NOT IN ('pending', 'sending') AND created_at < ?",
+                           (now - OUTBOX_KEEP_DAYS * 86400,))
+
+    def retry(self, item_id, attempts, not_before, error):
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("UPDATE outbox SET state = 'pending', attempts = ?, not_before = ?, last_error = ? WHERE id = ?",
+                           (attempts, not_before, error, item_id))
+
+    def fail(self, item_id, attempts, error):
+        with self._lock:
+            db = self._db()
+            with db:
+                db.execute("UPDATE outbox SET state = 'failed', story = NULL, attempts = ?, last_error = ? WHERE id = ?",
+                           (attempts, error, item_id))
+
+    def fail_account(self, item_id, error):
+        """item_id와 같은 계정의 대기 항목을 모두 실패 처리하고 개수 반환 (로그인이 안 되는 계정)"""
+        with self._lock:
+            db = self._db()
+            with db:
+                return db.execute(
+                    "UPDATE outbox SET state = 'failed', story = NULL, last_error = ? "
+                    "WHERE state = 'pending' AND account = (SELECT account FROM outbox WHERE id = ?)",
+                    (error, item_id),
+                ).rowcount
+
+    def pending_count(self):
+        with self._lock:
+            return self._db().execute(
+                "SELECT COUNT(*) FROM outbox WHERE state IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+def outbox_retryable(error):
+    """다시 시도해도 소용없는 오류(로그인 정보 오류, 챌린지, 모르는 학교)면 False"""
+    from instagrapi.exceptions import BadPassword, ChallengeRequired, TwoFactorRequired, ReloginAttemptExceeded
+    return not isinstance(error, (BadPassword, ChallengeRequired, TwoFactorRequired, ReloginAttemptExceeded, KeyError))
+
+def outbox_retry_delay(attempts, error):
+    """재시도 대기 시간: 지수 백오프 + 지터, 인스타그램이 속도 제한을 걸었으면 더 길게"""
+    from instagrapi.exceptions import PleaseWaitFewMinutes, ClientThrottledError, FeedbackRequired
+    delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** (attempts - 1))
+    if isinstance(error, (PleaseWaitFewMinutes, ClientThrottledError, FeedbackRequired)):
+        delay = max(delay, OUTBOX_THROTTLE_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+class OutboxUploader:
+    """대기열을 비우는 업로드 스레드 (계정별 간격 유지, 실패하면 백오프 후 재시도)"""
+    def __init__(self, outbox, interval=None):
+        self.outbox = outbox
+        self.interval = interval  # None이면 STORY_UPLOAD_INTERVAL
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.fatal = []  # 재시도하지 않고 포기한 오류 [(학교/종류, 오류)]
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self.outbox.recover()
+            self._thread = threading.Thread(target=self._run, name="uploader", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            try:
+                delay = self.run_once()
+            except Exception as e:
+                logger.error(f"Uploader error: {e}", exc_info=True)
+                delay = OUTBOX_RETRY_BASE
+            if delay != 0:
+                self._wakeup.wait(SCHEDULER_MAX_SLEEP if delay is None else min(delay, SCHEDULER_MAX_SLEEP))
+
+    def run_once(self):
+        """보낼 수 있는 항목 하나를 처리하고 다음 확인까지 기다릴 시간(초) 반환 (대기 항목이 없으면 None)"""
+        self.outbox.recover()
+        self.outbox.expire(datetime.now().strftime('%Y%m%d'))
+        interval = STORY_UPLOAD_INTERVAL if self.interval is None else self.interval
+        item, ready_at = self.outbox.next_due(interval)
+        if item is None:
+            return None
+        now = time.time()
+        if ready_at > now:
+            return ready_at - now
+        item_id, tenant_name, kind, fingerprint, attempts, job = item
+        data = self.outbox.claim(item_id)
+        if data is None:
+            return 0
+        try:
+            # 업로드는 작업이 끝난 뒤 이 스레드에서 하므로 넣은 작업 이름으로 업로드 단계 요약을 따로 남김
+            with job_trace(f"{job or 'outbox'} upload"), span("outbox.upload", kind=kind, attempt=attempts + 1):
+                bot = get_instagram_bot(get_tenant(tenant_name))
+                posted = upload_story(bot, Story(data, fingerprint))
+        except Exception as e:
+            attempts += 1
+            if not outbox_retryable(e):
+                self.outbox.fail(item_id, attempts, repr(e))
+                skipped = self.outbox.fail_account(item_id, repr(e))
+                self.fatal.append((f"{tenant_name}/{kind}", e))
+                metrics.inc("lunchbot_outbox_failed_total", kind=kind)
+                logger.error(f"Upload of {tenant_name}/{kind} failed and will not be retried "
+                             f"(같은 계정 대기 {skipped}건도 포기): {e!r}")
+            elif attempts >= OUTBOX_MAX_ATTEMPTS:
+                self.outbox.fail(item_id, attempts, repr(e))
+                metrics.inc("lunchbot_outbox_failed_total", kind=kind)
+                logger.error(f"Giving up on {tenant_name}/{kind} after {attempts} attempts: {e}")
+            else:
+                delay = outbox_retry_delay(attempts, e)
+                self.outbox.retry(item_id, attempts, now + delay, repr(e))
+                metrics.inc("lunchbot_outbox_retries_total", kind=kind)
+                logger.warning(f"Upload of {tenant_name}/{kind} failed (attempt {attempts}), 재시도 {delay:.0f}초 후: {e}")
+            return 0
+        self.outbox.done(item_id, sent=posted)
+        return 0
+
+    def drain(self, timeout=None):
+        """대기열이 빌 때까지(최대 timeout초) 기다리고 남은 항목 수 반환"""
+        self.start()
+        self.notify()
+        deadline = time.monotonic() + (OUTBOX_DRAIN_TIMEOUT if timeout is None else timeout)
+        while True:
+            remaining = self.outbox.pending_count()
+            if not remaining or time.monotonic() >= deadline:
+                return remaining
+            time.sleep(0.2)
+
+upload_outbox = UploadOutbox()
+outbox_uploader = OutboxUploader(upload_outbox)
+
+def enqueue_story(story, kind, tenant=None):
+    """스토리를 대기열에 넣고 업로더를 깨움"""
+    if not story:
+        return None
+    tenant = tenant or DEFAULT_TENANT
+    _tenants.setdefault(tenant.name, tenant)
+    item_id = upload_outbox.enqueue(tenant, kind, story)
+    outbox_uploader.notify()
+    return item_id
+
+# =========================
+# 로컬 스토리 서비스 (--serve)
+# =========================
+class StoryCache:
+    """인코딩된 스토리를 입력 지문별로 메모리에 두는 크기 제한 LRU"""
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or STORY_CACHE_BYTES
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+        count_cache("story_memory", data is not None)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+story_cache = StoryCache()
+
+def serve_story(date, kind, tenant=None):
+    """(날짜, 종류) 스토리를 최신 입력으로 돌려줌 (메모리 -> 렌더링 캐시 -> 렌더링 순, 없으면 None)
+
+    중식/석식은 식단으로, 오늘 날씨는 저장된 예보로 바로 만들고 나머지는 보관소에서 찾는다.
+    """
+    render = None
+    if kind in ("lunch", "dinner"):
+        meal_code, meal_type = (2, "중식") if kind == "lunch" else (3, "석식")
+        menu = get_meal_repository(tenant).get_menu(date, meal_code)
+        if menu:
+            render = (render_menu_image, (menu, meal_type))
+    elif kind == "weather" and date == datetime.now().strftime('%Y%m%d'):
+        weather_data = get_weather_data(tenant)
+        if weather_data:
+            render = (render_weather_image, (weather_data,))
+    if render is None:
+        data = image_archive.get(*story_key(kind, date, tenant))
+        return Story(data, hashlib.sha256(data).hexdigest()) if data else None
+    fingerprint = story_fingerprint(*render)
+    story = story_cache.get(fingerprint)
+    if story is None:
+        # 메모리 캐시 적중은 요청마다 기록하지 않음 (적중률은 lunchbot_cache_requests_total로 봄)
+        with span("serve.render", kind=kind):
+            story = build_story(*render)
+        story_cache.put(fingerprint, story)
+    return story
+
+STORY_PATH_RE = re.compile(r"^/story/(\d{8})/([\w-]+)\.jpg$")
+
+def story_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class StoryHandler(BaseHTTPRequestHandler):
+        """GET /story/{YYYYMMDD}/{종류}.jpg, /weather.json, /cache.json (?tenant=이름)"""
+        def do_GET(self):
+            parsed = urlsplit(self.path)
+            query = dict(parse_qsl(parsed.query))
+            try:
+                tenant = get_tenant(query.get("tenant", DEFAULT_TENANT_NAME))
+            except KeyError as e:
+                self.send_error(404, str(e))
+                return
+            match = STORY_PATH_RE.match(parsed.path)
+            try:
+                date = match.group(1) if match else query.get("date")
+                if date is not None:
+                    date = datetime.strptime(date, '%Y%m%d')
+            except ValueError:
+                self.send_error(400, "date must be YYYYMMDD")
+                return
+            try:
+                if match:
+                    self.send_story(serve_story(*match.groups(), tenant))
+                elif parsed.path == "/weather.json":
+                    self.send_json(get_weather_data(tenant, date))
+                elif parsed.path == "/cache.json":
+                    self.send_json(story_cache.stats())
+                else:
+                    self.send_error(404)
+            except Exception as e:
+                logger.error(f"Story service error for {self.path}: {e}", exc_info=True)
+                self.send_error(500)
+
+        def send_story(self, story):
+            if story is None:
+                self.send_error(404)
+                return
+            etag = f'"{story.fingerprint}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_body(story, "image/jpeg", {"ETag": etag})
+
+        def send_json(self, data):
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_body(json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+        def send_body(self, body, content_type, headers=None):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-cache")
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StoryHandler
+
+def start_story_server(port=None, host=None):
+    """로컬 스토리 HTTP API를 백그라운드 스레드로 시작 (폰트/레이어/식단/예보가 프로세스에 남아 있음)"""
+    port = port or STORY_SERVER_PORT
+    if not port:
+        return None
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host or STORY_SERVER_HOST, port), story_handler())
+    threading.Thread(target=server.serve_forever, name="story-server", daemon=True).start()
+    logger.info(f"Story service: http://{host or STORY_SERVER_HOST}:{server.server_address[1]}/story/<YYYYMMDD>/<kind>.jpg")
+    return server
+
+# =========================
+# 마감 시각 기반 스케줄러
+# =========================
+class DailyJob:
+    def __init__(self, at, publish, prepare=None, warmup=None, name=None):
+        self.at = at              # "HH:MM"
+        self.publish = publish    # 마감 시각에 실행 (prepare 결과를 인자로 받음)
+        self.prepare = prepare    # 마감 전 준비 단계 (데이터 수집/렌더링)
+        self.warmup = warmup if warmup is not None else timedelta(minutes=WARMUP_MINUTES)
+        self.name = name or at
+        self.deadline = None
+        self.prepared = None      # 준비 단계 Future
+        self.warmed = False
+
+    def next_deadline(self, now):
+        hour, minute = map(int, self.at.split(":"))
+        deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if deadline <= now:
+            deadline += timedelta(days=1)
+        return deadline
+
+class DeadlineScheduler:
+    """다음 실행 시각까지 잠들어 있다가 깨어나는 일일 스케줄러
+
+    마감 WARMUP_MINUTES분 전에 준비 단계(가져오기/렌더링)를 먼저 돌려 두고
+    마감 시각에는 업로드만 한다. 매초 폴링하지 않는다. 작업 자체는 크기가
+    제한된 스레드 풀에서 실행되므로 같은 시각의 여러 학교가 동시에 처리된다.
+    """
+    def __init__(self, max_workers=None):
+        self._jobs = []
+        self._wakeup = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or TENANT_WORKERS, thread_name_prefix="job")
+
+    def every_day_at(self, at, publish, prepare=None, warmup=None, name=None):
+        job = DailyJob(at, publish, prepare, warmup, name)
+        job.deadline = job.next_deadline(datetime.now())
+        self._jobs.append(job)
+        self._wakeup.set()
+        return job
+
+    def next_event(self):
+        """(시각, 종류, 작업) 중 가장 빠른 것"""
+        events = []
+        for job in self._jobs:
+            if job.prepare and not job.warmed:
+                events.append((job.deadline - job.warmup, "warmup", job))
+            events.append((job.deadline, "publish", job))
+        return min(events, key=lambda e: e[0]) if events else None
+
+    def run_pending(self):
+        now = datetime.now()
+        while True:
+            event = self.next_event()
+            if event is None or event[0] > now:
+                return event
+            _, kind, job = event
+            if kind == "warmup":
+                self._run_warmup(job)
+            else:
+                self._run_publish(job)
+                job.deadline = job.next_deadline(max(now, job.deadline))
+
+    def _run_warmup(self, job):
+        job.warmed = True
+        logger.info(f"Warm-up for {job.name} started.")
+        job.prepared = self._executor.submit(self._prepare, job)
+
+    @staticmethod
+    def _prepare(job):
+        with job_trace(f"{job.name} warm-up"):
+            return job.prepare()
+
+    def _run_publish(self, job):
+        prepared_future = job.prepared
+        job.prepared = None
+        job.warmed = False
+        self._executor.submit(self._publish, job, prepared_future)
+
+    def _publish(self, job, prepared_future):
+        prepared = None
+        if prepared_future is not None:
+            try:
+                prepared = prepared_future.result(timeout=PREPARE_WAIT)
+            except Exception as e:
+                # 준비 단계가 멈췄거나 실패하면 기다리지 않고 마감 시각에 다시 준비
+                logger.error(f"Warm-up for {job.name} failed: {e!r}", exc_info=True)
+        try:
+            with job_trace(job.name):
+                # 준비 결과가 없으면(준비 실패, 사진 미게시 등) 마감 시각에 다시 준비
+                if job.prepare and not prepared:
+                    prepared = job.prepare()
+                if job.prepare:
+                    job.publish(prepared)
+                else:
+                    job.publish()
+        except Exception as e:
+            logger.error(f"{job.name} failed: {e}", exc_info=True)
+
+    def run_forever(self):
+        while True:
+            event = self.run_pending()
+            if event is None:
+                self._wakeup.wait()
+            else:
+                delay = (event[0] - datetime.now()).total_seconds()
+                logger.info(f"Next {event[1]} at: {event[0]}")
+                # 시계 조정에 대비해 최대 SCHEDULER_MAX_SLEEP초마다 다시 계산
+                self._wakeup.wait(max(0, min(delay, SCHEDULER_MAX_SLEEP)))
+            self._wakeup.clear()
+
+scheduler = DeadlineScheduler()
 
 # =========================
 # 스케줄 등록 및 메인 진입점
 # =========================
-def register_schedules():
-    # 07:00 텍스트 중식/석식/날씨
-    schedule.every().day.at("07:00").do(job_text_menu_weather)
-    # 11:50 중식이 있는 날만 급식 이미지
-    schedule.every().day.at("11:50").do(job_lunch_photo_only_story)
+def schedule_text_menu_weather(sched, tenant):
+    """07:00 텍스트 중식/석식/날씨 (준비 단계는 PIPELINE_MODE에 따라 동기/비동기 파이프라인)"""
+    return sched.every_day_at(
+        tenant.text_time,
+        partial(publish_text_menu_weather, tenant=tenant),
+        partial(prepare_text_menu_weather, tenant),
+        name=f"{tenant.name} text {tenant.text_time}",
+    )
+
+def register_schedules(tenants=None):
+    for tenant in tenants or [DEFAULT_TENANT]:
+        schedule_text_menu_weather(scheduler, tenant)
+        # 중식이 있는 날 급식 사진이 올라오는 즉시 게시 (예상 시각 전부터 마감 시각까지 감시)
+        watch_start = photo_watch_start(tenant)
+        scheduler.every_day_at(
+            watch_start,
+            partial(start_photo_watch, tenant),
+            name=f"{tenant.name} photo watch {watch_start}",
+        )
+        # 감시 시간대 중에 다시 시작한 경우 내일까지 기다리지 않음
+        now = datetime.now()
+        if at_time(now, watch_start) <= now < at_time(now, tenant.photo_cutoff):
+            start_photo_watch(tenant)
 
 def main():
     parser = argparse.ArgumentParser(description="Upload Instagram story")
@@ -600,26 +3507,79 @@ def main():
     parser.add_argument("--uploadmenu", action="store_true", help="급식 텍스트 스토리 업로드")
     parser.add_argument("--uploadmenuimage", action="store_true", help="급식 이미지+텍스트 스토리 업로드")
     parser.add_argument("--uploadweather", action="store_true", help="날씨 스토리 업로드")
+    parser.add_argument("--drain", action="store_true", help="업로드 대기열에 남은 스토리만 올리고 종료")
+    parser.add_argument("--watchphoto", action="store_true", help="급식 사진이 올라올 때까지(마감 시각까지) 감시하다가 바로 게시")
+    parser.add_argument("--backfill", metavar="FROM..TO", type=parse_date_range,
+                        help="기간(YYYYMMDD..YYYYMMDD)의 중식/석식 스토리를 미리 만들어 보관소에 저장")
+    parser.add_argument("--pregenerate", metavar="DAYS", type=int, nargs="?", const=7,
+                        help="내일부터 DAYS일(기본 7일)치 스토리를 미리 만들어 보관소에 저장")
+    parser.add_argument("--serve", metavar="PORT", type=int, nargs="?", const=STORY_SERVER_PORT or 8080,
+                        help="로컬 스토리 API만 띄워 둠 (/story/<YYYYMMDD>/<kind>.jpg, /weather.json)")
+    parser.add_argument("--search-menu", metavar="TEXT", help="지난 식단에서 메뉴 이름 검색 (최근순)")
+    parser.add_argument("--allergen", metavar="N", type=int, choices=range(1, 20),
+                        help="알레르기 N번(1-19)이 든 끼니 목록 (--month, 기본 이번 달)")
+    parser.add_argument("--month", metavar="YYYYMM", help="--allergen 검색 월")
+    parser.add_argument("--tenant", help="tenants.json에서 이 학교만 실행 (기본: 전체)")
     args = parser.parse_args()
+    if args.pregenerate is not None and args.pregenerate < 1:
+        parser.error("--pregenerate DAYS must be at least 1")
 
-    if args.uploadmenu:
-        upload_menu_story()
-    elif args.uploadmenuimage:
-        upload_menu_image_story()
-    elif args.uploadweather:
-        upload_weather_story()
-    elif args.genweather:
-        generate_weather_image()
-    elif args.uploadnow:
-        job_text_menu_weather()
-    else:
-        logger.info("Program initiated.")
-        register_schedules()
-        next_run = schedule.next_run()
-        logger.info(f"Next scheduled run at: {next_run}")
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+    start_metrics_server()
+    tenants = load_tenants()
+    if args.tenant:
+        tenants = [t for t in tenants if t.name == args.tenant]
+        if not tenants:
+            parser.error(f"unknown tenant: {args.tenant}")
+
+    if args.genweather:
+        generate_weather_image(tenants[0])
+        return
+    if args.search_menu or args.allergen is not None:
+        query_meal_history(tenants[0], args.search_menu, args.allergen, args.month)
+        return
+    if args.serve:
+        server = start_story_server(args.serve)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+    if args.backfill or args.pregenerate is not None:
+        pregenerate_stories(args.backfill or upcoming_dates(args.pregenerate), tenants)
+        return
+    if not (args.uploadmenu or args.uploadmenuimage or args.uploadweather or args.uploadnow
+            or args.watchphoto or args.drain):
+        logger.info(f"Program initiated. ({len(tenants)} tenant(s))")
+        get_render_pool()
+        register_schedules(tenants)
+        # 업로드는 별도 스레드가 대기열에서 꺼내 올림 (이전 실행에서 남은 항목 포함)
+        outbox_uploader.start()
+        start_story_server()
+        scheduler.run_forever()
+        return
+    failed = False
+    try:
+        if args.uploadmenu:
+            run_for_tenants(upload_menu_story, tenants)
+        elif args.uploadmenuimage:
+            run_for_tenants(upload_menu_image_story, tenants)
+        elif args.uploadweather:
+            run_for_tenants(upload_weather_story, tenants)
+        elif args.uploadnow:
+            run_for_tenants(job_text_menu_weather, tenants)
+        elif args.watchphoto:
+            outbox_uploader.start()
+            run_for_tenants(lambda tenant: PhotoWatcher(tenant).run(), tenants)
+    except TenantJobError:
+        # 실패한 학교는 이미 로그에 남았고, 성공한 학교의 스토리는 아래에서 마저 올림
+        failed = True
+    # 1회 실행 명령은 대기열이 빌 때까지 기다렸다가 종료 (남은 항목은 다음 실행 때 이어서 올림)
+    remaining = outbox_uploader.drain()
+    if remaining:
+        logger.warning(f"{remaining} story(ies) left in outbox, will retry on next run")
+    if failed or outbox_uploader.fatal:
+        # 로그인 실패처럼 재시도할 수 없는 오류는 예전처럼 바로 실패로 끝냄
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file